@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -37,3 +39,13 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def run_on_commit_immediately(monkeypatch):
+    """Транзакция теста не коммитится, а кэш сайта сбрасывается
+    после коммита: колбэки on_commit выполняются сразу."""
+    from django.db import transaction
+    monkeypatch.setattr(
+        transaction, 'on_commit', lambda func, using=None: func()
+    )
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .querycache import (install_write_tracking,
+                                 query_cache_setting_changed)
+        connection_created.connect(install_write_tracking)
+        setting_changed.connect(query_cache_setting_changed)
@@ -0,0 +1,49 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Фильтр Блума: множество строк с ложноположительными ответами.
+
+    Если значения нет в фильтре, его точно нет и в исходном множестве.
+    Если есть - оно там есть с вероятностью 1 - error_rate.
+    Хранится в bytearray и кладется в кэш как есть.
+    """
+    # На маленьком множестве фильтр минимального размера почти
+    # не ошибается, а места занимает немного.
+    MIN_SIZE = 1024
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(
+            math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2),
+            self.MIN_SIZE
+        )
+        self.hashes = max(round(-math.log2(error_rate)), 1)
+        self.bits = bytearray(math.ceil(self.size / 8))
+
+    @classmethod
+    def from_values(cls, values, capacity, error_rate=0.01):
+        bloom = cls(capacity, error_rate)
+        for value in values:
+            bloom.add(value)
+        return bloom
+
+    def positions(self, value):
+        """Номера битов значения: двойное хеширование одним blake2b."""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return (
+            (first + number * second) % self.size
+            for number in range(self.hashes)
+        )
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << position % 8
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position // 8] & 1 << position % 8
+            for position in self.positions(value)
+        )
@@ -0,0 +1,279 @@
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .serializers import get_serializer
+
+# Страницы из core.caching: views.page.<формат>.<key_prefix>....
+PAGE_KEY_RE = re.compile(r'^views\.page\.\d+\.([^.]+)')
+# Число заведенных мест под статистику процессов и сами места.
+SLOTS_KEY = 'cache-stats:slots'
+SLOT_KEY = 'cache-stats:slot:{}'
+
+_local = threading.local()
+
+
+def key_prefix(key):
+    """Группа ключа в статистике: страницы - по key_prefix view,
+    остальные ключи - по первым двум частям через двоеточие
+    (posts:entity, generation:posts, querycache:default)."""
+    key = str(key)
+    match = PAGE_KEY_RE.match(key)
+    if match:
+        return f'views.page.{match.group(1)}'
+    return ':'.join(key.split(':')[:2])
+
+
+def current_view():
+    return getattr(_local, 'view', None)
+
+
+def set_current_view(view_name):
+    _local.view = view_name
+
+
+@contextmanager
+def measured_view(view_name):
+    """Обращения к кэшу внутри блока учитываются и для view_name."""
+    previous = current_view()
+    set_current_view(view_name)
+    try:
+        yield
+    finally:
+        set_current_view(previous)
+
+
+def instrumented_cache(alias='default'):
+    """Кэш alias, если он считает статистику, иначе None."""
+    cache = caches[alias]
+    return cache if isinstance(cache, InstrumentedCache) else None
+
+
+def format_metrics(stats, namespace='yatube_cache'):
+    """Счетчики в текстовом формате Prometheus."""
+    metrics = {}
+    for (scope, name, metric), value in sorted(stats.items()):
+        name = name.replace('\\', '\\\\').replace('"', '\\"')
+        metrics.setdefault(metric, []).append(
+            f'{namespace}_{metric}_total{{{scope}="{name}"}} {value:g}'
+        )
+    lines = []
+    for metric, samples in metrics.items():
+        lines.append(f'# TYPE {namespace}_{metric}_total counter')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCache(BaseCache):
+    """Обертка над алиасом OPTIONS['CACHE'], считающая статистику.
+
+    Для каждой группы ключей (см. key_prefix) и каждого view, внутри
+    которого шло обращение (см. measured_view), считаются чтения,
+    попадания, промахи, записи, размер записанных значений
+    в сериализованном виде и время чтения и записи.
+
+        'BACKEND': 'core.cache.instrumented.InstrumentedCache',
+        'OPTIONS': {'CACHE': 'measured', 'FLUSH_INTERVAL': 10},
+
+    Чтобы не сериализовать каждое значение второй раз, размер
+    измеряется у случайной записи из SIZE_SAMPLE (по умолчанию 10):
+    set_bytes - сумма по измеренным sized_sets записям.
+
+    Раз в FLUSH_INTERVAL секунд процесс кладет свои счетчики в кэш,
+    откуда их суммирует collect_stats() - для команды cache_stats
+    и страницы метрик. У LocMemCache кэш свой в каждом процессе,
+    поэтому там видна статистика только текущего процесса.
+
+    Место процесса, который SLOT_TIMEOUT секунд (по умолчанию 10 минут)
+    не сбрасывал счетчики, истекает и достается новому процессу, так что
+    мест столько, сколько процессов работало за это время, а не сколько
+    их было запущено.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._cache_alias = options['CACHE']
+        self._flush_interval = options.get('FLUSH_INTERVAL', 10)
+        self._slot_timeout = options.get('SLOT_TIMEOUT', 60 * 10)
+        self._serializer = get_serializer(options)
+        self._size_sample = options.get('SIZE_SAMPLE', 10)
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        self._slot = None
+        self._owner = uuid.uuid4().hex
+        self._pid = os.getpid()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def _cache(self):
+        return caches[self._cache_alias]
+
+    def _record(self, key, **metrics):
+        labels = [('prefix', key_prefix(key))]
+        view = current_view()
+        if view is not None:
+            labels.append(('view', view))
+        with self._lock:
+            for label in labels:
+                for name, value in metrics.items():
+                    self._stats[(*label, name)] += value
+
+    def _record_gets(self, keys, found, seconds):
+        for key in keys:
+            hit = key in found
+            self._record(
+                key, gets=1, hits=int(hit), misses=int(not hit),
+                get_seconds=seconds / len(keys),
+            )
+        self._maybe_flush()
+
+    def _record_sets(self, data, seconds):
+        for key, value in data.items():
+            metrics = {'sets': 1, 'set_seconds': seconds / len(data)}
+            if random.random() * self._size_sample < 1:
+                metrics.update(
+                    sized_sets=1,
+                    set_bytes=len(self._serializer.dumps(value)),
+                )
+            self._record(key, **metrics)
+        self._maybe_flush()
+
+    def stats(self):
+        """Счетчики текущего процесса: {(scope, name, metric): value}."""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self._flush_interval:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Кладет счетчики процесса в его место в кэше."""
+        self._flushed_at = time.monotonic()
+        if self._pid != os.getpid():
+            # После fork у дочернего процесса свои счетчики и место.
+            self.reset_stats()
+            self._pid = os.getpid()
+            self._slot = None
+            self._owner = uuid.uuid4().hex
+        value = (self._owner, self.stats())
+        # Место, которое истекло и досталось другому процессу,
+        # не перезаписывается.
+        if self._slot is not None and self._owns(self._slot):
+            self._cache.set(
+                SLOT_KEY.format(self._slot), value, self._slot_timeout
+            )
+        else:
+            self._slot = self._claim_slot(value)
+
+    def _owns(self, slot):
+        stored = self._cache.get(SLOT_KEY.format(slot))
+        return stored is not None and stored[0] == self._owner
+
+    def _claim_slot(self, value):
+        """Занимает истекшее место, а если свободных нет - новое."""
+        slots = self._cache.get(SLOTS_KEY) or 0
+        for slot in range(1, slots + 1):
+            if self._cache.add(
+                SLOT_KEY.format(slot), value, self._slot_timeout
+            ):
+                return slot
+        self._cache.add(SLOTS_KEY, 0, None)
+        slot = self._cache.incr(SLOTS_KEY)
+        self._cache.set(SLOT_KEY.format(slot), value, self._slot_timeout)
+        return slot
+
+    def collect_stats(self):
+        """Счетчики всех процессов, положивших их в кэш, и текущего."""
+        slots = self._cache.get(SLOTS_KEY) or 0
+        stored = self._cache.get_many([
+            SLOT_KEY.format(slot) for slot in range(1, slots + 1)
+        ])
+        total = Counter(self.stats())
+        for owner, stats in stored.values():
+            if owner != self._owner:
+                total.update(stats)
+        return dict(total)
+
+    def get(self, key, default=None, version=None):
+        started = time.monotonic()
+        value = self._cache.get(key, self, version=version)
+        found = {} if value is self else {key: value}
+        self._record_gets([key], found, time.monotonic() - started)
+        return default if value is self else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        started = time.monotonic()
+        values = self._cache.get_many(keys, version=version)
+        if keys:
+            self._record_gets(keys, values, time.monotonic() - started)
+        return values
+
+    def has_key(self, key, version=None):
+        started = time.monotonic()
+        found = self._cache.has_key(key, version=version)
+        self._record_gets(
+            [key], {key: None} if found else {}, time.monotonic() - started
+        )
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.monotonic()
+        added = self._cache.add(key, value, timeout, version=version)
+        if added:
+            self._record_sets({key: value}, time.monotonic() - started)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.monotonic()
+        self._cache.set(key, value, timeout, version=version)
+        self._record_sets({key: value}, time.monotonic() - started)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.monotonic()
+        failed = self._cache.set_many(data, timeout, version=version)
+        if data:
+            self._record_sets(data, time.monotonic() - started)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self._cache.incr(key, delta, version=version)
+        self._record(key, incrs=1)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def delete(self, key, version=None):
+        self._cache.delete(key, version=version)
+        self._record(key, deletes=1)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._cache.delete_many(keys, version=version)
+        for key in keys:
+            self._record(key, deletes=1)
+
+    def clear(self):
+        self._cache.clear()
+        self._slot = None
+
+    def close(self, **kwargs):
+        self._cache.close(**kwargs)
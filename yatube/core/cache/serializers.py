@@ -0,0 +1,171 @@
+import json
+import marshal
+import pickle
+import struct
+import zlib
+from array import array
+
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+# Заголовок значения: версия формата, тип значения, флаги.
+HEADER = struct.Struct('<BcB')
+ZLIB = 1
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+SIZE = struct.Struct('<I')
+
+
+class SerializerError(ValueError):
+    """Значение записано в неизвестном формате: считаем его промахом."""
+
+
+def get_serializer(options):
+    """Сериализатор из OPTIONS['SERIALIZER'] алиаса кэша."""
+    serializer = options.get('SERIALIZER', PickleSerializer)
+    if isinstance(serializer, str):
+        serializer = import_string(serializer)
+    return serializer(**options.get('SERIALIZER_OPTIONS', {}))
+
+
+class PickleSerializer:
+    """pickle, как у встроенных бэкендов Django."""
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class CompactSerializer:
+    """Компактный двоичный формат для частых значений кэша.
+
+    Байты, строки, числа и списки id пишутся как есть, HttpResponse -
+    статус, заголовки и тело без служебных полей объекта, словари
+    и списки из простых значений - через marshal, кортежи из остальных
+    значений - поэлементно. Остальное - pickle.
+    Значения длиннее compress_from байт сжимаются zlib.
+
+    Первый байт - VERSION: значения другого формата читаются
+    как промах, поэтому формат можно менять без очистки кэша.
+    """
+    VERSION = 1
+
+    def __init__(self, compress_from=1024, compress_level=6):
+        self.compress_from = compress_from
+        self.compress_level = compress_level
+
+    def dumps(self, value):
+        kind, payload = self.encode(value)
+        flags = 0
+        if len(payload) >= self.compress_from:
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, ZLIB
+        return HEADER.pack(self.VERSION, kind, flags) + payload
+
+    def loads(self, data):
+        try:
+            version, kind, flags = HEADER.unpack_from(data)
+        except struct.error:
+            raise SerializerError('Слишком короткое значение')
+        if version != self.VERSION:
+            raise SerializerError(f'Неизвестная версия формата {version}')
+        payload = memoryview(data)[HEADER.size:]
+        if flags & ZLIB:
+            payload = zlib.decompress(payload)
+        return self.decode(kind, bytes(payload))
+
+    def encode(self, value):
+        if type(value) is bytes:
+            return b'b', value
+        if type(value) is str:
+            return b's', value.encode()
+        if type(value) is HttpResponse and not value.cookies:
+            return b'r', self.encode_response(value)
+        if type(value) in (int, list, tuple, dict):
+            encoded = self.encode_builtin(value)
+            if encoded is not None:
+                return encoded
+        return b'p', pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def encode_builtin(self, value):
+        if type(value) is tuple and len(value) == 2 and (
+            type(value[1]) is float
+        ):
+            # Значение со сроком свежести из core.caching.pack.
+            kind, payload = self.encode(value[0])
+            return b'f', FLOAT.pack(value[1]) + kind + payload
+        try:
+            if type(value) is int:
+                return b'i', INT.pack(value)
+            if type(value) is list and value and all(
+                type(item) is int for item in value
+            ):
+                return b'l', array('q', value).tobytes()
+        except (struct.error, OverflowError):
+            pass
+        try:
+            return b'm', marshal.dumps(value)
+        except ValueError:
+            pass
+        if type(value) is tuple:
+            # Например, страница из core.caching: ответ и сжатое тело.
+            return b't', b''.join(
+                kind + SIZE.pack(len(payload)) + payload
+                for kind, payload in map(self.encode, value)
+            )
+        return None
+
+    def decode(self, kind, payload):
+        if kind == b'b':
+            return payload
+        if kind == b's':
+            return payload.decode()
+        if kind == b'i':
+            return INT.unpack(payload)[0]
+        if kind == b'l':
+            return array('q', payload).tolist()
+        if kind == b'r':
+            return self.decode_response(payload)
+        if kind == b'f':
+            fresh_until, = FLOAT.unpack_from(payload)
+            inner = payload[FLOAT.size:]
+            return self.decode(inner[:1], inner[1:]), fresh_until
+        if kind == b'm':
+            return marshal.loads(payload)
+        if kind == b't':
+            return tuple(self.decode_items(payload))
+        if kind == b'p':
+            return pickle.loads(payload)
+        raise SerializerError(f'Неизвестный тип значения {kind!r}')
+
+    def decode_items(self, payload):
+        position = 0
+        while position < len(payload):
+            kind = payload[position:position + 1]
+            size, = SIZE.unpack_from(payload, position + 1)
+            start = position + 1 + SIZE.size
+            yield self.decode(kind, payload[start:start + size])
+            position = start + size
+
+    def encode_response(self, response):
+        meta = json.dumps([
+            response.status_code,
+            response.charset,
+            [list(header) for header in response.items()],
+        ]).encode()
+        return SIZE.pack(len(meta)) + meta + response.content
+
+    def decode_response(self, payload):
+        size, = SIZE.unpack_from(payload)
+        start = SIZE.size
+        status, charset, headers = json.loads(payload[start:start + size])
+        response = HttpResponse(
+            payload[start + size:], status=status, charset=charset
+        )
+        for name, value in headers:
+            response[name] = value
+        return response
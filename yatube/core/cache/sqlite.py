@@ -0,0 +1,290 @@
+import os
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .serializers import SerializerError, get_serializer
+
+# value - последний столбец: остальные читаются со страницы строки
+# без чтения страниц переполнения с большим значением.
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' size INTEGER NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL,'
+    ' value BLOB NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    # Число записей и их объем ведут триггеры в той же транзакции,
+    # что и запись, поэтому _cull не считает их по всей таблице.
+    'CREATE TABLE IF NOT EXISTS cache_totals ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+    ' entries INTEGER NOT NULL,'
+    ' size INTEGER NOT NULL'
+    ')',
+    'CREATE TRIGGER IF NOT EXISTS cache_inserted AFTER INSERT ON cache '
+    'BEGIN UPDATE cache_totals'
+    ' SET entries = entries + 1, size = size + NEW.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_deleted AFTER DELETE ON cache '
+    'BEGIN UPDATE cache_totals'
+    ' SET entries = entries - 1, size = size - OLD.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_resized AFTER UPDATE OF size ON cache '
+    'BEGIN UPDATE cache_totals SET size = size - OLD.size + NEW.size; END',
+)
+# Итоги для файла, созданного до cache_totals, считаются один раз.
+INIT_TOTALS = (
+    'INSERT OR IGNORE INTO cache_totals (id, entries, size) '
+    'SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+)
+# Столбцы перечисляются явно: в файлах, созданных раньше, value
+# стоит перед size. INSERT OR REPLACE не годится: удаление
+# замененной строки не вызывает триггер.
+INSERT = (
+    'INSERT INTO cache (key, size, expires, accessed, value) '
+    'VALUES (?, ?, ?, ?, ?)'
+)
+UPSERT = INSERT + (
+    ' ON CONFLICT (key) DO UPDATE SET size = excluded.size,'
+    ' expires = excluded.expires, accessed = excluded.accessed,'
+    ' value = excluded.value'
+)
+# Время последнего чтения обновляется не чаще, чем раз в столько секунд,
+# чтобы каждое чтение не превращалось в запись.
+ACCESS_GRANULARITY = 1.0
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite в режиме WAL, общий для процессов одного хоста.
+
+    Подключается в CACHES вместо LocMemCache:
+
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'MAX_SIZE': 256 * 1024 * 1024},
+
+    При превышении MAX_ENTRIES записей или MAX_SIZE байт вытесняется
+    1/CULL_FREQUENCY давно не читавшихся записей (LRU).
+    incr/decr атомарны между процессами.
+
+    Значения кодирует OPTIONS['SERIALIZER'] (по умолчанию pickle),
+    см. core.cache.serializers.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._max_size = int(options.get('MAX_SIZE', 0)) or None
+        self._busy_timeout = float(options.get('BUSY_TIMEOUT', 5))
+        self._serializer = get_serializer(options)
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self._path, timeout=self._busy_timeout,
+                isolation_level=None, check_same_thread=False
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            if connection.execute(
+                'SELECT 1 FROM cache_totals'
+            ).fetchone() is None:
+                with _Transaction(connection):
+                    connection.execute(INIT_TOTALS)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def _dumps(self, value):
+        return self._serializer.dumps(value)
+
+    def _loads(self, data):
+        return self._serializer.loads(data)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        data = self._dumps(value)
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)
+            )
+            added = connection.execute(
+                INSERT + ' ON CONFLICT (key) DO NOTHING',
+                (key, len(data), self.get_backend_timeout(timeout), now, data)
+            ).rowcount
+        if added:
+            self._cull()
+        return bool(added)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        return {
+            made[key]: value
+            for key, value in self._get_many(list(made)).items()
+        }
+
+    def _get_many(self, keys):
+        if not keys:
+            return {}
+        now = time.time()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._connection.execute(
+            f'SELECT key, value, expires, accessed FROM cache '
+            f'WHERE key IN ({placeholders})', keys
+        ).fetchall()
+        values = {}
+        expired = []
+        touched = []
+        for key, data, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                expired.append(key)
+                continue
+            try:
+                values[key] = self._loads(data)
+            except SerializerError:
+                # Записано другим форматом: считаем промахом.
+                continue
+            if now - accessed > ACCESS_GRANULARITY:
+                touched.append(key)
+        if expired or touched:
+            with self._transaction() as connection:
+                connection.executemany(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    [(key, now) for key in expired]
+                )
+                connection.executemany(
+                    'UPDATE cache SET accessed = ? WHERE key = ?',
+                    [(now, key) for key in touched]
+                )
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        rows = []
+        for key, value in data.items():
+            dumped = self._dumps(value)
+            rows.append(
+                (self._key(key, version), len(dumped), expires, now, dumped)
+            )
+        with self._transaction() as connection:
+            connection.executemany(UPSERT, rows)
+        self._cull()
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._transaction() as connection:
+            return bool(connection.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time())
+            ).rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = self._loads(row[0]) + delta
+            data = self._dumps(value)
+            connection.execute(
+                'UPDATE cache SET value = ?, size = ? WHERE key = ?',
+                (data, len(data), key)
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._key(key, version),) for key in keys]
+        with self._transaction() as connection:
+            connection.executemany('DELETE FROM cache WHERE key = ?', keys)
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        """Соединения живут весь процесс: открывать файл на каждый
+        запрос дороже, чем держать его открытым."""
+
+    def _cull(self):
+        count, size = self._connection.execute(
+            'SELECT entries, size FROM cache_totals'
+        ).fetchone()
+        if count <= self._max_entries and (
+            self._max_size is None or size <= self._max_size
+        ):
+            return
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+            )
+            if self._cull_frequency == 0:
+                connection.execute('DELETE FROM cache')
+                return
+            connection.execute(
+                'DELETE FROM cache WHERE key IN ('
+                ' SELECT key FROM cache ORDER BY accessed LIMIT ?'
+                ')',
+                (max(count // self._cull_frequency, 1),)
+            )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT: блокировка на запись берется сразу,
+    поэтому чтение и запись внутри не перемешиваются с другими
+    процессами."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+CLEAR_ALL = '*'
+
+# Журналы общие для всех потоков процесса, как и их L1.
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+class InvalidationChannel:
+    """Рассылка инвалидаций между процессами через файл-журнал.
+
+    Пишущий процесс дописывает в конец файла строку с ключом, читающие
+    помнят, до какого места дочитали. Проверка новых сообщений - один
+    os.stat. Разросшийся журнал заменяется пустым; заметив новый файл,
+    процессы забывают все локальные значения.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._inode = None
+        self._offset = 0
+
+    def publish(self, messages):
+        data = ''.join(json.dumps(message) + '\n' for message in messages)
+        with open(self.path, 'a', encoding='utf-8') as channel:
+            channel.write(data)
+            size = channel.tell()
+        if size > self.max_size:
+            self.rotate()
+
+    def rotate(self):
+        rotated = f'{self.path}.{os.getpid()}.{threading.get_ident()}'
+        open(rotated, 'w').close()
+        os.replace(rotated, self.path)
+
+    def receive(self):
+        """Новые сообщения и отметка о прочитанном месте журнала.
+
+        Вместо сообщений возвращает [CLEAR_ALL], если журнал заменили.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return [], (self._inode, self._offset)
+            if stat.st_ino != self._inode:
+                clear = self._inode is not None
+                self._inode, self._offset = stat.st_ino, 0
+                messages = [CLEAR_ALL] if clear else []
+                messages += self._read()
+                return messages, (self._inode, self._offset)
+            if stat.st_size == self._offset:
+                return [], (self._inode, self._offset)
+            return self._read(), (self._inode, self._offset)
+
+    def _read(self):
+        with open(self.path, 'rb') as channel:
+            channel.seek(self._offset)
+            data = channel.read()
+        # Строка, которую еще дописывают, дочитается в следующий раз.
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+        return [json.loads(line) for line in data.decode().splitlines()]
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: LRU в памяти процесса (L1) перед общим L2.
+
+    L2 - другой алиас из CACHES, например SQLiteCache или memcached.
+    Значения ключей с префиксами из L1_KEYS (по умолчанию все) читаются
+    из памяти процесса. Запись через этот кэш рассылает инвалидацию
+    в журнал LOCATION, и другие процессы убирают ключ из своего L1
+    при следующем обращении к кэшу. Без LOCATION рассылки нет,
+    это подходит только для одного процесса.
+
+        'BACKEND': 'core.cache.tiered.TieredCache',
+        'LOCATION': '/var/tmp/yatube-cache.channel',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_KEYS': ('generation:',),
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+        },
+
+    L1_TIMEOUT ограничивает жизнь значения в L1, если сообщение
+    о его изменении все-таки потеряется.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options['L2']
+        self._local_keys = tuple(options.get('L1_KEYS', ()))
+        self._local = LocMemCache(f'tiered:{location}:{options["L2"]}', {
+            'TIMEOUT': options.get('L1_TIMEOUT', 60),
+            'OPTIONS': {'MAX_ENTRIES': options.get('L1_MAX_ENTRIES', 1000)},
+        })
+        self._channel = None
+        if location:
+            max_size = options.get('CHANNEL_MAX_SIZE', 1024 * 1024)
+            with _channels_lock:
+                self._channel = _channels.setdefault(
+                    location, InvalidationChannel(location, max_size)
+                )
+
+    @property
+    def _shared(self):
+        return caches[self._shared_alias]
+
+    def _is_local(self, key):
+        return not self._local_keys or str(key).startswith(self._local_keys)
+
+    def _version(self, version):
+        return self.version if version is None else version
+
+    def _sync(self):
+        """Применяет инвалидации других процессов к L1."""
+        if self._channel is None:
+            return None
+        messages, position = self._channel.receive()
+        for message in messages:
+            if message == CLEAR_ALL:
+                self._local.clear()
+            else:
+                self._local.delete(*message)
+        return position
+
+    def _invalidate(self, keys, version):
+        keys = [key for key in keys if self._is_local(key)]
+        if not keys:
+            return
+        version = self._version(version)
+        self._local.delete_many(keys, version=version)
+        if self._channel is not None:
+            self._channel.publish([[key, version] for key in keys])
+
+    def _fill(self, values, position, version):
+        """Кладет прочитанные из L2 значения в L1, если пока их читали,
+        никто не прислал инвалидаций. Иначе значение могло устареть."""
+        if not values:
+            return
+        version = self._version(version)
+        self._local.set_many(values, version=version)
+        if self._sync() != position:
+            self._local.delete_many(values, version=version)
+
+    def get(self, key, default=None, version=None):
+        if not self._is_local(key):
+            return self._shared.get(key, default, version=version)
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        local_keys = [key for key in keys if self._is_local(key)]
+        position = self._sync()
+        values = self._local.get_many(
+            local_keys, version=self._version(version)
+        )
+        missing = [key for key in keys if key not in values]
+        found = self._shared.get_many(missing, version=version)
+        self._fill({
+            key: value for key, value in found.items() if self._is_local(key)
+        }, position, version)
+        values.update(found)
+        return values
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._shared.add(key, value, timeout, version=version)
+        if added:
+            self._invalidate([key], version)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._shared.set(key, value, timeout, version=version)
+        self._invalidate([key], version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._shared.set_many(data, timeout, version=version)
+        self._invalidate(list(data), version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self._shared.incr(key, delta, version=version)
+        self._invalidate([key], version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self._shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._shared.delete(key, version=version)
+        self._invalidate([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._shared.delete_many(keys, version=version)
+        self._invalidate(keys, version)
+
+    def clear(self):
+        self._shared.clear()
+        self._local.clear()
+        if self._channel is not None:
+            self._channel.publish([CLEAR_ALL])
+
+    def close(self, **kwargs):
+        self._shared.close(**kwargs)
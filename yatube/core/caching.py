@@ -0,0 +1,333 @@
+import gzip
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+SESSION_LAST_WRITE = 'cache_last_write'
+LOCK_POLL_INTERVAL = 0.05
+# Меняется вместе с форматом закэшированной страницы.
+PAGE_FORMAT = 3
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+logger = logging.getLogger(__name__)
+
+
+def generation_key(name):
+    """Ключ кэша со счетчиком поколения данных name."""
+    return f'generation:{name}'
+
+
+def initial_generation():
+    """Начальное значение поколения.
+
+    Берется от времени, чтобы после вытеснения счетчика из кэша
+    не вернуться к номеру, под которым уже лежат старые страницы.
+    """
+    return int(time.time() * 1000)
+
+
+def get_generations(names):
+    """Текущие поколения данных names.
+
+    Недостающие поколения заводятся со сроком GENERATION_CACHE_TIME:
+    имена из ссылок на несуществующие объекты не копятся в кэше.
+    Заведенное заново поколение больше прежнего (см. initial_generation).
+    """
+    keys = [generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            generation = initial_generation()
+            cache.add(key, generation, settings.GENERATION_CACHE_TIME)
+            values[key] = cache.get(key, generation)
+    return [values[key] for key in keys]
+
+
+def bump_generation(*names):
+    """Начинает новое поколение: старые закэшированные страницы
+    больше не читаются и вытесняются по TTL."""
+    for name in names:
+        try:
+            cache.incr(generation_key(name))
+        except ValueError:
+            cache.add(
+                generation_key(name), initial_generation(),
+                settings.GENERATION_CACHE_TIME
+            )
+
+
+def renew_generations(*names):
+    """Начинает новые поколения names одной записью в кэш, а не incr
+    на каждое имя: так сбрасываются страницы многих пользователей сразу.
+
+    Запись не атомарна, поэтому новое поколение случайное, а не
+    следующее: параллельный сброс не вернет имени прежнее значение.
+    """
+    cache.set_many(
+        {generation_key(name): random.getrandbits(62) for name in names},
+        settings.GENERATION_CACHE_TIME
+    )
+
+
+def remember_write(request):
+    """Запоминает в сессии время записи пользователя: страницы,
+    построенные раньше, ему не отдаются (см. is_older_than_write).
+
+    Сравнивается время, а не поколения: у LocMemCache поколения
+    в каждом процессе свои.
+    """
+    request.session[SESSION_LAST_WRITE] = time.time()
+
+
+def viewer_generation(user_id):
+    """Имя поколения данных пользователя, которые видны в шапке
+    каждой страницы, например числа новых записей в подписках."""
+    return f'viewer:{user_id}'
+
+
+def viewer_generations(request):
+    """Поколения, от которых страница зависит через шапку."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return ()
+    return (viewer_generation(user.pk),)
+
+
+def viewer_key(request):
+    """Часть ключа страницы, зависящая от пользователя.
+
+    Для вошедших пользователей учитывается и CSRF-cookie: после входа
+    токен меняется, и формы из старой страницы перестают работать.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return ''
+    csrf = hashlib.md5(
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, '').encode()
+    ).hexdigest()
+    return f'{user.pk}.{csrf}'
+
+
+def page_cache_key(request, key_prefix, generations=None):
+    """Ключ страницы: поколения, пользователь и полный URL.
+
+    Без generations получается ключ последней построенной версии
+    страницы, какого бы поколения она ни была.
+    """
+    viewer = viewer_key(request)
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    stamp = 'latest'
+    if generations is not None:
+        stamp = '.'.join(str(generation) for generation in generations)
+    return f'views.page.{PAGE_FORMAT}.{key_prefix}.{stamp}.{viewer}.{url}'
+
+
+def pack(value, timeout):
+    """Значение со сроком свежести для хранения в кэше."""
+    return value, time.time() + timeout
+
+
+def store(values, timeout):
+    """Кладет значения в кэш на timeout и еще CACHE_STALE_GRACE
+    секунд, в которые они отдаются как устаревшие."""
+    cache.set_many(
+        {key: pack(value, timeout) for key, value in values.items()},
+        timeout + settings.CACHE_STALE_GRACE
+    )
+
+
+def compute_and_store(key, compute, timeout, fallback_key, should_cache):
+    try:
+        value = compute()
+        if should_cache is None or should_cache(value):
+            values = {key: value}
+            if fallback_key is not None:
+                values[fallback_key] = value
+            store(values, timeout)
+    finally:
+        cache.delete(f'{key}.lock')
+    return value
+
+
+def refresh(key, compute, timeout, fallback_key, should_cache):
+    """Пересчитывает устаревшее значение, не задерживая ответ.
+
+    Ошибка пересчета не страшна: до конца CACHE_STALE_GRACE
+    отдается прежнее значение.
+    """
+    def update():
+        try:
+            compute_and_store(
+                key, compute, timeout, fallback_key, should_cache
+            )
+        except Exception:
+            logger.exception('Не удалось обновить %s', key)
+
+    if not settings.CACHE_REFRESH_IN_BACKGROUND:
+        update()
+        return
+
+    def target():
+        try:
+            update()
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=target, daemon=True).start()
+
+
+def get_stale(fallback_key):
+    if fallback_key is None:
+        return None
+    entry = cache.get(fallback_key)
+    return None if entry is None else entry[0]
+
+
+def get_or_set_locked(key, compute, timeout, fallback_key=None,
+                      should_cache=None):
+    """Cache-aside с защитой от одновременного пересчета ключа.
+
+    При промахе значение считает только запрос, взявший блокировку.
+    Остальные сразу получают предыдущее значение из fallback_key,
+    а если его нет, ждут до CACHE_LOCK_WAIT секунд и после этого
+    считают сами.
+
+    Значение старше timeout еще CACHE_STALE_GRACE секунд отдается
+    сразу, а пересчитывается в фоне. Если пересчет при промахе падает
+    с ошибкой базы данных, отдается предыдущее значение.
+    """
+    lock_key = f'{key}.lock'
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() >= fresh_until and cache.add(
+            lock_key, 1, settings.CACHE_LOCK_TIMEOUT
+        ):
+            refresh(key, compute, timeout, fallback_key, should_cache)
+        return value
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    while not cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+        value = get_stale(fallback_key)
+        if value is not None:
+            return value
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    try:
+        return compute_and_store(
+            key, compute, timeout, fallback_key, should_cache
+        )
+    except DatabaseError:
+        value = get_stale(fallback_key)
+        if value is None:
+            raise
+        logger.exception('Отдается устаревшее значение %s', key)
+        return value
+
+
+def is_older_than_write(request, page):
+    """Страница построена раньше последней записи пользователя."""
+    session = getattr(request, 'session', None)
+    if session is None:
+        return False
+    return page[2] < session.get(SESSION_LAST_WRITE, 0)
+
+
+def is_cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+    )
+
+
+def compress_page(response, built_at):
+    """Страница для кэша: ответ, его тело, сжатое gzip, и время,
+    когда страница начала строиться.
+
+    Сжимается один раз при записи, а не на каждое попадание.
+    """
+    if not is_cacheable(response) or response.has_header('Content-Encoding'):
+        return response, None, built_at
+    response['Content-Length'] = str(len(response.content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if len(response.content) < settings.PAGE_GZIP_FROM:
+        return response, None, built_at
+    return response, gzip.compress(response.content, mtime=0), built_at
+
+
+def build_page(view_func, request, *args, **kwargs):
+    built_at = time.time()
+    return compress_page(view_func(request, *args, **kwargs), built_at)
+
+
+def page_response(request, page):
+    """Ответ в кодировке, которую принимает клиент."""
+    response, compressed, _ = page
+    if compressed is None or not ACCEPTS_GZIP_RE.search(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')
+    ):
+        return response
+    gzipped = HttpResponse(compressed, status=response.status_code)
+    for name, value in response.items():
+        gzipped[name] = value
+    gzipped['Content-Encoding'] = 'gzip'
+    gzipped['Content-Length'] = str(len(compressed))
+    return gzipped
+
+
+def cache_page_generations(timeout, key_prefix, generations):
+    """Кэширует страницу до смены поколения данных generations.
+
+    В отличие от cache_page страница не устаревает через короткий TTL:
+    запись в данные увеличивает поколение, и следующий запрос строит
+    страницу заново. Страницы разделяются по пользователю, потому что
+    шапка сайта у каждого своя, и учитывают поколение его шапки
+    (см. viewer_generation). Заголовки кэширования браузера
+    не выставляются.
+
+    generations - имена поколений или функция, которая получает
+    аргументы view и возвращает их.
+
+    Промах пересчитывает один запрос, остальные получают последнюю
+    построенную версию страницы (см. get_or_set_locked). Пользователю,
+    который только что записал данные, страница старше его записи
+    не отдается (см. remember_write).
+
+    Вместе со страницей хранится ее тело, сжатое gzip: клиент с
+    Accept-Encoding: gzip получает его без сжатия на каждый запрос.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            names = generations
+            if callable(generations):
+                names = generations(*args, **kwargs)
+            names = (*names, *viewer_generations(request))
+            page = get_or_set_locked(
+                page_cache_key(request, key_prefix, get_generations(names)),
+                lambda: build_page(view_func, request, *args, **kwargs),
+                timeout,
+                fallback_key=page_cache_key(request, key_prefix),
+                should_cache=lambda page: is_cacheable(page[0]),
+            )
+            if is_older_than_write(request, page):
+                return view_func(request, *args, **kwargs)
+            return page_response(request, page)
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,11 @@
+from posts.feeds import unread_count
+
+
+def unread_posts(request):
+    """Добавляет количество новых записей в ленте подписок."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'unread_posts': unread_count(user)
+    }
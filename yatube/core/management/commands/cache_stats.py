@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cache.instrumented import instrumented_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает попадания, промахи, размер значений и время '
+        'обращений к кэшу по группам ключей или по view. Нужен '
+        'CACHE_STATS=True: статистику считает InstrumentedCache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--by', choices=('prefix', 'view'), default='prefix',
+            help='Группировать по префиксу ключа или по view'
+        )
+
+    def handle(self, *args, **options):
+        cache = instrumented_cache()
+        if cache is None:
+            raise CommandError(
+                'Кэш default не считает статистику, включите CACHE_STATS'
+            )
+        rows = {}
+        for (scope, name, metric), value in cache.collect_stats().items():
+            if scope == options['by']:
+                rows.setdefault(name, {})[metric] = value
+        self.stdout.write(
+            f'{options["by"]:<40} {"чтений":>9} {"попад.":>7} '
+            f'{"чтение, мс":>10} {"записей":>8} {"байт":>9} '
+            f'{"запись, мс":>10}'
+        )
+        for name, row in sorted(rows.items()):
+            gets, sets = row.get('gets', 0), row.get('sets', 0)
+            set_bytes, sized = row.get('set_bytes', 0), row.get(
+                'sized_sets', 0
+            )
+            self.stdout.write(
+                f'{name:<40} {gets:>9.0f} '
+                f'{self.ratio(row.get("hits", 0), gets):>7} '
+                f'{self.average(row.get("get_seconds", 0) * 1000, gets):>10} '
+                f'{sets:>8.0f} '
+                f'{self.average(set_bytes, sized, "{:.0f}"):>9} '
+                f'{self.average(row.get("set_seconds", 0) * 1000, sets):>10}'
+            )
+
+    def ratio(self, part, total):
+        return f'{part / total:.0%}' if total else '-'
+
+    def average(self, value, count, template='{:.2f}'):
+        return template.format(value / count) if count else '-'
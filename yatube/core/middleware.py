@@ -0,0 +1,16 @@
+from .cache.instrumented import measured_view, set_current_view
+
+
+class CacheStatsMiddleware:
+    """Относит обращения к кэшу во время запроса к его view
+    (см. core.cache.instrumented)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with measured_view(None):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        set_current_view(request.resolver_match.view_name)
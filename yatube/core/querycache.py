@@ -0,0 +1,206 @@
+import hashlib
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.db.models.query import ModelIterable
+
+from .caching import bump_generation, get_generations
+
+TABLES_RE = re.compile(r'\b(?:FROM|JOIN)\s+[`"]?(\w+)[`"]?', re.IGNORECASE)
+WRITE_RE = re.compile(
+    r'^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+[`"]?(\w+)[`"]?',
+    re.IGNORECASE
+)
+
+stats = Counter()
+_local = threading.local()
+
+
+def table_generation(table):
+    """Поколение данных таблицы."""
+    return f'table:{table}'
+
+
+def cached_tables():
+    """Таблицы моделей из QUERY_CACHE_MODELS."""
+    return {
+        apps.get_model(label)._meta.db_table
+        for label in settings.QUERY_CACHE_MODELS
+    }
+
+
+def record(event):
+    if settings.QUERY_CACHE_STATS:
+        stats[event] += 1
+
+
+def query_cache_stats():
+    """Попадания, промахи, обходы кэша запросов и сбросы таблиц."""
+    return dict(stats)
+
+
+@contextmanager
+def bypass_query_cache():
+    """Запросы внутри блока идут в базу мимо кэша."""
+    previous = getattr(_local, 'bypass', False)
+    _local.bypass = True
+    try:
+        yield
+    finally:
+        _local.bypass = previous
+
+
+def invalidate_tables(tables):
+    """Новое поколение таблиц: закэшированные запросы к ним
+    больше не читаются."""
+    bump_generation(*(table_generation(table) for table in tables))
+    for _ in tables:
+        record('invalidations')
+
+
+def track_writes(execute, sql, params, many, context):
+    """execute_wrapper: любая запись в таблицу из QUERY_CACHE_MODELS
+    сбрасывает ее поколение, в том числе update(), delete()
+    и bulk_create(), для которых нет сигналов.
+
+    Внутри транзакции поколение сбрасывается после коммита: иначе
+    другой процесс мог бы закэшировать данные до коммита. Сама
+    транзакция читает мимо кэша (см. CachedQuerySet.query_cache_key).
+    """
+    result = execute(sql, params, many, context)
+    if not settings.QUERY_CACHE_ENABLED:
+        return result
+    match = WRITE_RE.match(sql)
+    if match and match.group(1) in cached_tables():
+        table = match.group(1)
+        connection = context['connection']
+        if connection.in_atomic_block:
+            transaction.on_commit(
+                lambda: invalidate_tables([table]), using=connection.alias
+            )
+        else:
+            invalidate_tables([table])
+    return result
+
+
+def install_write_tracking(sender, connection, **kwargs):
+    """Обработчик connection_created. Без QUERY_CACHE_ENABLED запись
+    не отслеживается."""
+    if (
+        settings.QUERY_CACHE_ENABLED
+        and track_writes not in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.append(track_writes)
+
+
+def query_cache_setting_changed(setting, value, **kwargs):
+    """Обработчик setting_changed: кэш, включенный в тестах,
+    отслеживает запись и в уже открытых соединениях."""
+    if setting == 'QUERY_CACHE_ENABLED' and value:
+        for connection in connections.all():
+            install_write_tracking(None, connection)
+
+
+class CachedQuerySet(QuerySet):
+    """QuerySet, результаты которого кэшируются до записи в таблицы.
+
+    Ключ - SQL запроса с параметрами и поколения всех таблиц из него.
+    Кэш включается QUERY_CACHE_ENABLED, а обходится bypass_query_cache()
+    или uncached(). Запросы к таблицам не из QUERY_CACHE_MODELS,
+    select_for_update и запросы внутри транзакции идут в базу.
+    """
+
+    def uncached(self):
+        clone = self._chain()
+        clone._query_cache_bypass = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._query_cache_bypass = getattr(
+            self, '_query_cache_bypass', False
+        )
+        return clone
+
+    def query_cache_key(self):
+        """Ключ кэша или None, если запрос нельзя кэшировать."""
+        if (
+            not settings.QUERY_CACHE_ENABLED
+            or connections[self.db].in_atomic_block
+            or getattr(_local, 'bypass', False)
+            or getattr(self, '_query_cache_bypass', False)
+            or self.query.select_for_update
+        ):
+            return None
+        try:
+            sql, params = self.query.get_compiler(using=self.db).as_sql()
+        except EmptyResultSet:
+            return None
+        tables = sorted(set(TABLES_RE.findall(sql)))
+        if not tables or not set(tables) <= cached_tables():
+            record('bypasses')
+            return None
+        stamp = '.'.join(
+            str(generation) for generation in get_generations(
+                [table_generation(table) for table in tables]
+            )
+        )
+        digest = hashlib.md5(
+            f'{self._iterable_class.__name__}|{sql}|{params!r}'.encode()
+        ).hexdigest()
+        return f'querycache:{self.db}:{stamp}:{digest}'
+
+    def cached(self, key, compute):
+        value = cache.get(key)
+        if value is not None:
+            record('hits')
+            return value
+        record('misses')
+        value = compute()
+        cache.set(key, value, settings.QUERY_CACHE_TIME)
+        return value
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            key = self.query_cache_key()
+            if key is not None:
+                self._result_cache = self.cached(
+                    key, lambda: list(self._iterable_class(self))
+                )
+                self._set_known_related_objects()
+        super()._fetch_all()
+
+    def _set_known_related_objects(self):
+        """Связанные объекты, известные менеджеру (author.posts),
+        подставляются заново: в кэше лежат их копии."""
+        if self._iterable_class is not ModelIterable:
+            return
+        for field, objects in self._known_related_objects.items():
+            for obj in self._result_cache:
+                related = objects.get(getattr(obj, field.attname))
+                if related is not None:
+                    setattr(obj, field.name, related)
+
+    def count(self):
+        key = None if self._result_cache is not None else (
+            self.query_cache_key()
+        )
+        if key is None:
+            return super().count()
+        return self.cached(f'{key}:count', super().count)
+
+    def exists(self):
+        key = None if self._result_cache is not None else (
+            self.query_cache_key()
+        )
+        if key is None:
+            return super().exists()
+        return self.cached(f'{key}:exists', super().exists)
@@ -0,0 +1,62 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from core.caching import get_generations
+from posts.generations import post_card_generations
+
+register = template.Library()
+
+
+def get_stamps(posts):
+    """Штампы поколений карточек: один запрос к кэшу на все записи."""
+    names = [post_card_generations(post) for post in posts]
+    generations = iter(get_generations(
+        [name for post_names in names for name in post_names]
+    ))
+    return {
+        post.pk: '.'.join(str(next(generations)) for _ in post_names)
+        for post, post_names in zip(posts, names)
+    }
+
+
+def post_card_stamp(context, post):
+    """Штамп карточки. Для записей страницы page_obj штампы читаются
+    сразу для всей страницы и запоминаются в ней."""
+    page_obj = context.get('page_obj')
+    if page_obj is None or post not in page_obj.object_list:
+        return get_stamps([post])[post.pk]
+    if not hasattr(page_obj, 'post_card_stamps'):
+        page_obj.post_card_stamps = get_stamps(list(page_obj))
+    return page_obj.post_card_stamps[post.pk]
+
+
+class PostCardNode(template.Node):
+    def __init__(self, nodelist, post):
+        self.nodelist = nodelist
+        self.post = post
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        key = f'template.post_card.{post.pk}.{post_card_stamp(context, post)}'
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = self.nodelist.render(context)
+            cache.set(key, fragment, settings.FRAGMENT_CACHE_TIME)
+        return fragment
+
+
+@register.tag
+def cache_post_card(parser, token):
+    """Кэширует карточку записи до изменения записи, автора или группы.
+
+    {% cache_post_card post %} ... {% endcache_post_card %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает один аргумент: запись'
+        )
+    nodelist = parser.parse(('endcache_post_card',))
+    parser.delete_first_token()
+    return PostCardNode(nodelist, parser.compile_filter(bits[1]))
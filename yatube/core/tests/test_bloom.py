@@ -0,0 +1,26 @@
+from django.test import SimpleTestCase
+
+from ..bloom import BloomFilter
+
+
+class BloomFilterTest(SimpleTestCase):
+    def test_no_false_negatives(self):
+        """Все добавленные значения находятся в фильтре."""
+        values = [f'user{number}' for number in range(1000)]
+        bloom = BloomFilter.from_values(values, len(values))
+        for value in values:
+            self.assertIn(value, bloom)
+
+    def test_error_rate(self):
+        """Доля ложных срабатываний близка к заданной."""
+        bloom = BloomFilter.from_values(
+            (f'user{number}' for number in range(1000)), 1000, 0.01
+        )
+        false_positives = sum(
+            f'missing{number}' in bloom for number in range(10000)
+        )
+        self.assertLess(false_positives, 300)
+
+    def test_empty(self):
+        """В пустом фильтре ничего нет."""
+        self.assertNotIn('user', BloomFilter.from_values([], 0))
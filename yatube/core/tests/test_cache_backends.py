@@ -0,0 +1,403 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from ..cache.instrumented import (SLOT_KEY, SLOTS_KEY, InstrumentedCache,
+                                  instrumented_cache, key_prefix)
+from ..cache.serializers import CompactSerializer, SerializerError
+from ..cache.sqlite import SQLiteCache
+from ..cache.tiered import InvalidationChannel, TieredCache
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_get_set_delete(self):
+        """Значения сохраняются, читаются пачкой и удаляются."""
+        self.cache.set('key', {'a': [1, 2]})
+        self.cache.set_many({'one': 1, 'two': 2})
+        self.assertEqual(self.cache.get('key'), {'a': [1, 2]})
+        self.assertEqual(
+            self.cache.get_many(['one', 'two', 'three']), {'one': 1, 'two': 2}
+        )
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.has_key('one'))
+        self.cache.clear()
+        self.assertFalse(self.cache.has_key('one'))
+
+    def test_shared_between_instances(self):
+        """Кэш общий для всех, кто открыл тот же файл."""
+        self.cache.set('key', 'value')
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_expiry(self):
+        """Просроченные значения не читаются, add их перезаписывает."""
+        self.cache.set('key', 'old', 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+        self.assertFalse(self.cache.add('key', 'newer'))
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_incr_is_atomic(self):
+        """incr из разных потоков и соединений не теряет приращений."""
+        self.cache.set('counter', 0)
+
+        def worker():
+            cache = self.make_cache()
+            for _ in range(50):
+                cache.incr('counter')
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_evicts_least_recently_used(self):
+        """При переполнении вытесняются давно не читавшиеся записи."""
+        cache = self.make_cache(MAX_ENTRIES=4, CULL_FREQUENCY=2)
+        for number in range(4):
+            cache.set(number, number)
+        cache._connection.execute('UPDATE cache SET accessed = 0')
+        cache.get_many([0, 1])
+        cache.set('new', 'value')
+        self.assertEqual(cache.get_many([0, 1, 2, 3]), {0: 0, 1: 1})
+        self.assertEqual(cache.get('new'), 'value')
+
+    def test_max_size(self):
+        """Объем кэша ограничивается MAX_SIZE байт."""
+        cache = self.make_cache(MAX_SIZE=10000, CULL_FREQUENCY=2)
+        for number in range(20):
+            cache.set(number, 'x' * 1000)
+        size, = cache._connection.execute(
+            'SELECT SUM(size) FROM cache'
+        ).fetchone()
+        self.assertLessEqual(size, 10000 + 1100)
+        self.assertIsNotNone(cache.get(19))
+
+    def totals(self, cache):
+        return cache._connection.execute(
+            'SELECT entries, size FROM cache_totals'
+        ).fetchone()
+
+    def actual_totals(self, cache):
+        return cache._connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+        ).fetchone()
+
+    def test_totals(self):
+        """Число записей и объем ведутся без подсчета по таблице."""
+        self.cache.set_many({'one': 1, 'two': 'x' * 100})
+        self.cache.set('two', 'x' * 10)
+        self.cache.add('three', 3)
+        self.cache.add('three', 'x' * 100)
+        self.cache.set('counter', 9)
+        self.cache.incr('counter', 1000)
+        self.cache.delete('one')
+        self.assertEqual(self.totals(self.cache), self.actual_totals(
+            self.cache
+        ))
+        statements = []
+        self.cache._connection.set_trace_callback(statements.append)
+        self.cache.set('four', 4)
+        self.assertFalse([
+            statement for statement in statements if 'COUNT' in statement
+        ])
+        self.cache.clear()
+        self.assertEqual(self.totals(self.cache), (0, 0))
+
+    def test_old_file(self):
+        """Файл прежнего формата, без cache_totals и со столбцом value
+        перед size, читается, а итоги для него считаются при открытии."""
+        self.location = os.path.join(self.directory, 'old.sqlite3')
+        connection = sqlite3.connect(self.location)
+        connection.execute(
+            'CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB '
+            'NOT NULL, expires REAL, accessed REAL NOT NULL, '
+            'size INTEGER NOT NULL)'
+        )
+        connection.execute(
+            "INSERT INTO cache VALUES ('old', x'00', NULL, 0, 1)"
+        )
+        connection.commit()
+        connection.close()
+        cache = self.make_cache()
+        self.assertEqual(self.totals(cache), (1, 1))
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(self.totals(cache), self.actual_totals(cache))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-test-shared',
+    },
+})
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.location = os.path.join(self.directory, 'cache.channel')
+        self.worker = self.make_worker()
+        self.other_worker = self.make_worker()
+        self.worker.clear()
+
+    def make_worker(self, **options):
+        """Кэш отдельного процесса: свои L1 и место в журнале."""
+        cache = TieredCache(self.location, {
+            'OPTIONS': dict({'L2': 'shared'}, **options)
+        })
+        cache._local = LocMemCache(f'{self.location}:{id(cache)}', {})
+        cache._channel = InvalidationChannel(
+            self.location, options.get('CHANNEL_MAX_SIZE', 1024 * 1024)
+        )
+        return cache
+
+    def test_served_from_local_memory(self):
+        """Прочитанное значение читается из L1 без обращения к L2."""
+        self.worker.set('key', 'value')
+        self.assertEqual(self.worker.get('key'), 'value')
+        self.worker._shared.set('key', 'changed behind the cache')
+        self.assertEqual(self.worker.get('key'), 'value')
+
+    def test_invalidation_reaches_other_workers(self):
+        """Изменение и удаление ключа убирают его из L1 всех процессов."""
+        self.worker.set_many({'key': 'value', 'counter': 1})
+        self.assertEqual(
+            self.other_worker.get_many(['key', 'counter']),
+            {'key': 'value', 'counter': 1}
+        )
+        self.worker.incr('counter')
+        self.worker.delete('key')
+        self.assertEqual(self.other_worker.get('counter'), 2)
+        self.assertIsNone(self.other_worker.get('key'))
+
+    def test_rotated_channel_clears_local_memory(self):
+        """После замены разросшегося журнала L1 очищается целиком."""
+        worker = self.make_worker(CHANNEL_MAX_SIZE=100)
+        worker.set('key', 'value')
+        self.assertEqual(self.other_worker.get('key'), 'value')
+        self.other_worker._shared.set('key', 'changed behind the cache')
+        for number in range(10):
+            worker.set(f'other:{number}', number)
+        self.assertEqual(
+            self.other_worker.get('key'), 'changed behind the cache'
+        )
+
+    def test_local_keys(self):
+        """В L1 попадают только ключи с префиксами из L1_KEYS."""
+        worker = self.make_worker(L1_KEYS=('generation:',))
+        worker.set_many({'generation:posts': 1, 'page': 'html'})
+        worker.get_many(['generation:posts', 'page'])
+        self.assertEqual(
+            worker._local.get_many(['generation:posts', 'page']),
+            {'generation:posts': 1}
+        )
+
+
+class CompactSerializerTest(SimpleTestCase):
+    def setUp(self):
+        self.serializer = CompactSerializer(compress_from=100)
+
+    def test_round_trip(self):
+        """Значения читаются такими же, какими были записаны."""
+        values = (
+            b'bytes', 'строка', 42, -2 ** 63, 2 ** 70, [1, 2, 3], [],
+            {'a': 1, 'b': [None, True, 1.5]}, (1, 'two'),
+            ('value', 1700000000.123456), {'date': datetime.date(2022, 1, 1)},
+            mark_safe('<b>html</b>'), 'x' * 1000,
+        )
+        for value in values:
+            with self.subTest(value=value):
+                loaded = self.serializer.loads(self.serializer.dumps(value))
+                self.assertEqual(loaded, value)
+                self.assertIs(type(loaded), type(value))
+
+    def test_response(self):
+        """От ответа сохраняются статус, заголовки и тело."""
+        response = HttpResponse('<p>страница</p>' * 100, status=201)
+        response['Vary'] = 'Cookie'
+        data = self.serializer.dumps(response)
+        self.assertLess(len(data), len(response.content))
+        loaded = self.serializer.loads(data)
+        self.assertEqual(loaded.status_code, 201)
+        self.assertEqual(loaded.content, response.content)
+        self.assertEqual(loaded['Vary'], 'Cookie')
+        self.assertEqual(loaded['Content-Type'], response['Content-Type'])
+
+    def test_compressed_page(self):
+        """Страница из кэша страниц: ответ, сжатое тело и время
+        построения со сроком."""
+        page = (HttpResponse('<p>страница</p>'), b'\x1f\x8b', 1699999999.5)
+        (response, body, built_at), fresh_until = self.serializer.loads(
+            self.serializer.dumps((page, 1700000000.5))
+        )
+        self.assertEqual(response.content, page[0].content)
+        self.assertEqual(body, page[1])
+        self.assertEqual(built_at, page[2])
+        self.assertEqual(fresh_until, 1700000000.5)
+
+    def test_unknown_version_is_a_miss(self):
+        """Значение другой версии формата считается промахом."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        cache = SQLiteCache(
+            os.path.join(directory, 'cache.sqlite3'),
+            {'OPTIONS': {'SERIALIZER': CompactSerializer}}
+        )
+        cache.set('key', [1, 2, 3])
+        self.assertEqual(cache.get('key'), [1, 2, 3])
+        cache._connection.execute(
+            "UPDATE cache SET value = X'FF6900'"
+        )
+        self.assertIsNone(cache.get('key'))
+        with self.assertRaises(SerializerError):
+            self.serializer.loads(b'\xff')
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'core.cache.instrumented.InstrumentedCache',
+        'OPTIONS': {
+            'CACHE': 'measured', 'FLUSH_INTERVAL': 3600, 'SIZE_SAMPLE': 1,
+        },
+    },
+    'measured': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'instrumented-test',
+    },
+})
+class InstrumentedCacheTest(TestCase):
+    def setUp(self):
+        self.cache = instrumented_cache()
+        self.cache.clear()
+        self.cache.reset_stats()
+
+    def test_prefixes(self):
+        """Статистика считается по группам ключей."""
+        self.assertEqual(key_prefix('posts:entity:user:1'), 'posts:entity')
+        self.assertEqual(
+            key_prefix('views.page.2.index_page.1.2..abc'),
+            'views.page.index_page'
+        )
+        self.cache.set('posts:entity:user:1', 'x' * 100)
+        self.cache.get('posts:entity:user:1')
+        self.cache.get_many(['posts:entity:user:2', 'generation:posts'])
+        stats = self.cache.stats()
+        self.assertEqual(stats[('prefix', 'posts:entity', 'gets')], 2)
+        self.assertEqual(stats[('prefix', 'posts:entity', 'hits')], 1)
+        self.assertEqual(stats[('prefix', 'posts:entity', 'misses')], 1)
+        self.assertEqual(stats[('prefix', 'generation:posts', 'misses')], 1)
+        self.assertEqual(stats[('prefix', 'posts:entity', 'sets')], 1)
+        self.assertEqual(stats[('prefix', 'posts:entity', 'sized_sets')], 1)
+        self.assertGreater(stats[('prefix', 'posts:entity', 'set_bytes')], 100)
+        self.assertIn(('prefix', 'posts:entity', 'get_seconds'), stats)
+
+    def test_views(self):
+        """Обращения во время запроса относятся к его view."""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        stats = self.cache.stats()
+        self.assertEqual(
+            stats[('view', 'posts:index', 'hits')]
+            + stats[('view', 'posts:index', 'misses')],
+            stats[('view', 'posts:index', 'gets')]
+        )
+        self.assertGreaterEqual(
+            stats[('prefix', 'views.page.index_page', 'hits')], 1
+        )
+
+    def test_size_sample(self):
+        """Размер измеряется только у части записей."""
+        sampled = InstrumentedCache('', {'OPTIONS': {
+            'CACHE': 'measured', 'SIZE_SAMPLE': 10 ** 9,
+        }})
+        sampled.set_many({f'posts:entity:user:{pk}': pk for pk in range(10)})
+        stats = sampled.stats()
+        self.assertEqual(stats[('prefix', 'posts:entity', 'sets')], 10)
+        self.assertNotIn(('prefix', 'posts:entity', 'set_bytes'), stats)
+
+    def test_collect_from_processes(self):
+        """Счетчики других процессов берутся из кэша."""
+        other = InstrumentedCache('', {'OPTIONS': {'CACHE': 'measured'}})
+        other.get('posts:entity:user:1')
+        other.flush_stats()
+        self.cache.get('posts:entity:user:1')
+        self.cache.flush_stats()
+        self.assertEqual(
+            self.cache.collect_stats()[('prefix', 'posts:entity', 'gets')], 2
+        )
+
+    def test_expired_slot_is_reused(self):
+        """Место процесса, переставшего сбрасывать счетчики, достается
+        новому процессу, а прежний владелец занимает другое."""
+        measured = caches['measured']
+        first = InstrumentedCache('', {'OPTIONS': {'CACHE': 'measured'}})
+        first.flush_stats()
+        measured.delete(SLOT_KEY.format(1))
+        second = InstrumentedCache('', {'OPTIONS': {'CACHE': 'measured'}})
+        second.flush_stats()
+        self.assertEqual(measured.get(SLOTS_KEY), 1)
+        first.get('posts:entity:user:1')
+        first.flush_stats()
+        self.assertEqual(measured.get(SLOTS_KEY), 2)
+        self.assertEqual(
+            second.collect_stats()[('prefix', 'posts:entity', 'gets')], 1
+        )
+
+    @override_settings(CACHE_METRICS_TOKEN='secret')
+    def test_metrics_and_command(self):
+        """Счетчики доступны сотрудникам, по токену и команде
+        cache_stats."""
+        self.cache.set('posts:entity:user:1', 1)
+        self.cache.get('posts:entity:user:1')
+        staff = get_user_model().objects.create(
+            username='staff', is_staff=True
+        )
+        self.client.force_login(staff)
+        response = self.client.get(reverse('cache_metrics'))
+        self.assertIn(
+            'yatube_cache_hits_total{prefix="posts:entity"} 1',
+            response.content.decode()
+        )
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertRegex(out.getvalue(), r'posts:entity +1 +100%')
+        self.client.logout()
+        for authorization, status in (
+            ('', 404), ('Bearer wrong', 404), ('Bearer secret', 200)
+        ):
+            with self.subTest(authorization=authorization):
+                response = self.client.get(
+                    reverse('cache_metrics'), REMOTE_ADDR='127.0.0.1',
+                    HTTP_AUTHORIZATION=authorization
+                )
+                self.assertEqual(response.status_code, status)
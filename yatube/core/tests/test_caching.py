@@ -0,0 +1,144 @@
+import gzip
+import time
+
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..caching import (generation_key, get_generations, get_or_set_locked,
+                       store)
+
+
+class GetOrSetLockedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return 'свежее'
+
+    def test_compute_once(self):
+        """Значение считается один раз и кладется в кэш."""
+        for _ in range(3):
+            self.assertEqual(
+                get_or_set_locked('key', self.compute, 60), 'свежее'
+            )
+        self.assertEqual(self.calls, 1)
+
+    def test_locked_returns_previous_value(self):
+        """Пока ключ пересчитывает другой запрос, отдается прежнее
+        значение."""
+        cache.set('key.lock', 1)
+        store({'previous': 'старое'}, 60)
+        value = get_or_set_locked(
+            'key', self.compute, 60, fallback_key='previous'
+        )
+        self.assertEqual(value, 'старое')
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(CACHE_LOCK_WAIT=0)
+    def test_locked_without_previous_value(self):
+        """Без прежнего значения запрос перестает ждать и считает сам."""
+        cache.set('key.lock', 1)
+        self.assertEqual(get_or_set_locked('key', self.compute, 60), 'свежее')
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_should_cache(self):
+        """Значения, которые нельзя кэшировать, не сохраняются."""
+        get_or_set_locked(
+            'key', self.compute, 60, should_cache=lambda value: False
+        )
+        self.assertIsNone(cache.get('key'))
+        self.assertIsNone(cache.get('key.lock'))
+
+    @override_settings(CACHE_REFRESH_IN_BACKGROUND=False)
+    def test_stale_while_revalidate(self):
+        """Устаревшее значение отдается, а в кэш кладется новое."""
+        store({'key': 'старое'}, -1)
+        self.assertEqual(get_or_set_locked('key', self.compute, 60), 'старое')
+        self.assertEqual(get_or_set_locked('key', self.compute, 60), 'свежее')
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(CACHE_REFRESH_IN_BACKGROUND=False)
+    def test_stale_while_revalidate_error(self):
+        """Ошибка пересчета в запросе не доходит до клиента: отдается
+        устаревшее значение."""
+        def broken():
+            raise ValueError('ошибка шаблона')
+
+        store({'key': 'старое'}, -1)
+        with self.assertLogs('core.caching', 'ERROR'):
+            self.assertEqual(get_or_set_locked('key', broken, 60), 'старое')
+        self.assertIsNone(cache.get('key.lock'))
+
+    @override_settings(CACHE_REFRESH_IN_BACKGROUND=True)
+    def test_refresh_in_background(self):
+        """Устаревшее значение обновляется в фоновом потоке."""
+        store({'key': 'старое'}, -1)
+        self.assertEqual(get_or_set_locked('key', self.compute, 60), 'старое')
+        deadline = time.monotonic() + 5
+        while cache.get('key.lock') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(get_or_set_locked('key', self.compute, 60), 'свежее')
+
+    def test_stale_on_error(self):
+        """Если пересчет падает, отдается прежнее значение."""
+        def broken():
+            raise OperationalError('database is locked')
+
+        store({'previous': 'старое'}, -1)
+        value = get_or_set_locked(
+            'key', broken, 60, fallback_key='previous'
+        )
+        self.assertEqual(value, 'старое')
+        self.assertIsNone(cache.get('key.lock'))
+        with self.assertRaises(OperationalError):
+            get_or_set_locked('other', broken, 60)
+
+
+class GenerationsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(GENERATION_CACHE_TIME=0)
+    def test_seeded_generation_expires(self):
+        """Заведенное при чтении поколение не остается в кэше навсегда."""
+        first, = get_generations(['group:нет-такой'])
+        self.assertIsNone(cache.get(generation_key('group:нет-такой')))
+        second, = get_generations(['group:нет-такой'])
+        self.assertGreaterEqual(second, first)
+
+
+@override_settings(PAGE_GZIP_FROM=0)
+class CompressedPageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_gzip_page(self):
+        """Клиент с Accept-Encoding: gzip получает сжатую страницу."""
+        url = reverse('posts:index')
+        plain = self.client.get(url)
+        for _ in range(2):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(
+                int(response['Content-Length']), len(response.content)
+            )
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(
+                gzip.decompress(response.content), plain.content
+            )
+
+    def test_identity_page(self):
+        """Без gzip в Accept-Encoding страница отдается как есть."""
+        url = reverse('posts:index')
+        self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(
+            int(response['Content-Length']), len(response.content)
+        )
+        self.assertIn('Accept-Encoding', response['Vary'])
@@ -0,0 +1,119 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from posts.models import Group, Post
+
+from ..caching import get_generations
+from ..querycache import (bypass_query_cache, query_cache_stats, stats,
+                          table_generation)
+
+User = get_user_model()
+
+
+@override_settings(QUERY_CACHE_ENABLED=True, QUERY_CACHE_STATS=True)
+class QueryCacheTest(TransactionTestCase):
+    """Записи сбрасывают кэш после коммита, поэтому тесты идут
+    вне транзакции TestCase."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='user')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.create(text='Тестовый пост', author=self.author)
+        cache.clear()
+        stats.clear()
+
+    def texts(self):
+        return [post.text for post in self.author.posts.select_related(
+            'author', 'group'
+        )]
+
+    def test_results_are_cached(self):
+        """Повторный запрос, count() и exists() не обращаются к базе."""
+        posts = Post.objects.filter(author=self.author)
+        self.assertEqual(self.texts(), ['Тестовый пост'])
+        posts.count()
+        posts.exists()
+        self.author.posts.first()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.texts(), ['Тестовый пост'])
+            self.assertEqual(posts.count(), 1)
+            self.assertTrue(posts.exists())
+            post = self.author.posts.first()
+        self.assertIs(post.author, self.author)
+        self.assertEqual(
+            query_cache_stats(), {'hits': 4, 'misses': 4}
+        )
+
+    def test_writes_invalidate_tables(self):
+        """Любая запись в таблицу сбрасывает закэшированные запросы."""
+        writes = (
+            lambda: Post.objects.create(text='Новый', author=self.author),
+            lambda: Post.objects.filter(text='Новый').update(text='Правка'),
+            lambda: Post.objects.bulk_create([
+                Post(text='Пачкой', author=self.author)
+            ]),
+            lambda: Post.objects.filter(text='Пачкой').delete(),
+        )
+        expected = (
+            ['Новый', 'Тестовый пост'],
+            ['Правка', 'Тестовый пост'],
+            ['Пачкой', 'Правка', 'Тестовый пост'],
+            ['Правка', 'Тестовый пост'],
+        )
+        for write, texts in zip(writes, expected):
+            self.texts()
+            write()
+            with self.subTest(texts=texts):
+                self.assertEqual(sorted(self.texts()), sorted(texts))
+
+    def test_joined_tables(self):
+        """Запрос сбрасывается и записью в присоединенную таблицу."""
+        self.texts()
+        self.author.first_name = 'Лев'
+        self.author.save()
+        with self.assertNumQueries(1):
+            self.texts()
+
+    def test_bypass(self):
+        """Кэш можно обойти для блока кода и для одного запроса."""
+        self.texts()
+        with self.assertNumQueries(1):
+            with bypass_query_cache():
+                self.texts()
+        with self.assertNumQueries(1):
+            list(self.author.posts.select_related(
+                'author', 'group'
+            ).uncached())
+
+    def posts_generation(self):
+        return get_generations([table_generation('posts_post')])[0]
+
+    def test_transaction(self):
+        """Транзакция читает мимо кэша, а сбрасывает его один раз,
+        после коммита."""
+        self.texts()
+        generation = self.posts_generation()
+        with transaction.atomic():
+            Post.objects.filter(author=self.author).update(text='Правка')
+            self.assertEqual(self.posts_generation(), generation)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.texts(), ['Правка'])
+        self.assertEqual(self.posts_generation(), generation + 1)
+        self.assertEqual(self.texts(), ['Правка'])
+
+    @override_settings(QUERY_CACHE_ENABLED=False)
+    def test_disabled(self):
+        """Без QUERY_CACHE_ENABLED запросы идут в базу, а запись
+        не сбрасывает поколения таблиц."""
+        self.texts()
+        generation = self.posts_generation()
+        Post.objects.create(text='Новый', author=self.author)
+        with self.assertNumQueries(1):
+            self.texts()
+        self.assertEqual(self.posts_generation(), generation)
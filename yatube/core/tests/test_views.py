@@ -0,0 +1,23 @@
+from http import HTTPStatus
+
+from django.core.cache import cache
+from django.test import TestCase
+
+
+class PageNotFoundTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_for_guests(self):
+        """Страница 404 для гостей рендерится один раз, адрес каждый раз
+        свой."""
+        self.client.get('/first/')
+        response = self.client.get('/second/<b>/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertTemplateNotUsed(response, 'core/404.html')
+        self.assertContains(
+            response, '/second/&lt;b&gt;/', status_code=HTTPStatus.NOT_FOUND
+        )
+        self.assertNotContains(
+            response, '/first/', status_code=HTTPStatus.NOT_FOUND
+        )
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.test import Client
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def warmup_host():
+    """Хост, под которым страницы кладутся в кэш.
+
+    Ключ страницы содержит полный URL, поэтому прогревать нужно
+    под тем же хостом и схемой, под которыми сайт открывают.
+    """
+    if settings.WARMUP_HOST:
+        return settings.WARMUP_HOST
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def fetch(url, host, secure):
+    """Запрашивает url анонимным клиентом внутри процесса.
+
+    Возвращает код ответа и время в секундах.
+    """
+    client = Client(HTTP_HOST=host)
+    started = time.monotonic()
+    try:
+        status = client.get(url, secure=secure).status_code
+    except Exception:
+        logger.exception('Не удалось прогреть %s', url)
+        status = None
+    return status, time.monotonic() - started
+
+
+def warm_urls(urls, workers=1, time_limit=None, host=None, secure=None):
+    """Прогревает кэш страниц, запрашивая urls через тестовый клиент.
+
+    Страницы запрашиваются в workers потоков. После time_limit секунд
+    новые запросы не начинаются, а уже начатые дожидаются.
+    Возвращает список (url, код ответа, время) в порядке urls;
+    для пропущенных по времени url код и время - None.
+    """
+    host = host or warmup_host()
+    secure = settings.WARMUP_SECURE if secure is None else secure
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    def warm(url):
+        if deadline is not None and time.monotonic() > deadline:
+            return url, None, None
+        try:
+            return (url, *fetch(url, host, secure))
+        finally:
+            if workers > 1:
+                close_old_connections()
+
+    if workers <= 1:
+        return [warm(url) for url in urls]
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(warm, urls))
+
+
+def warm_on_startup():
+    """Прогрев после запуска процесса, если включен WARMUP_ON_STARTUP.
+
+    Идет в фоновом потоке: процесс сразу начинает принимать запросы.
+    Кэш в памяти процесса (LocMemCache) греется только так,
+    команда warm_cache прогревает общий кэш.
+    """
+    if not settings.WARMUP_ON_STARTUP:
+        return None
+    get_urls = import_string(settings.WARMUP_URLS)
+    thread = threading.Thread(
+        target=lambda: warm_urls(
+            get_urls(), settings.WARMUP_WORKERS, settings.WARMUP_TIME_LIMIT
+        ),
+        name='cache-warmup',
+        daemon=True,
+    )
+    thread.start()
+    return thread
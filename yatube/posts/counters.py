@@ -0,0 +1,129 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from core.caching import bump_generation
+
+from .entities import forget_entities
+from .generations import (POSTS, group_generation, post_generation,
+                          profile_generation)
+from .models import AuthorStats, Comment, Post
+
+
+def count_posts(author_id):
+    return Post.objects.filter(author_id=author_id).count()
+
+
+def change_post_count(author_id, delta):
+    """Сдвигает счетчик записей автора на delta.
+
+    Вызывается из сигналов Post внутри транзакции записи. Если счетчика
+    еще нет, новая запись создает его по COUNT, уже учитывающему ее,
+    а удаление ничего не делает: счетчик посчитает get_post_count.
+    Так удаление автора со всеми записями не создает счетчик заново.
+    """
+    if author_id is None:
+        return
+    updated = AuthorStats.objects.filter(user_id=author_id).update(
+        post_count=Greatest(F('post_count') + delta, 0)
+    )
+    if not updated and delta > 0:
+        AuthorStats.objects.get_or_create(
+            user_id=author_id,
+            defaults={'post_count': count_posts(author_id)}
+        )
+
+
+def get_post_count(author_id):
+    """Количество записей автора из счетчика, без COUNT по записям."""
+    if author_id is None:
+        return 0
+    count = AuthorStats.objects.filter(user_id=author_id).values_list(
+        'post_count', flat=True
+    ).first()
+    if count is None:
+        stats, _ = AuthorStats.objects.get_or_create(
+            user_id=author_id,
+            defaults={'post_count': count_posts(author_id)}
+        )
+        count = stats.post_count
+    return count
+
+
+def reconcile_post_counts():
+    """Исправляет расхождения счетчиков с записями одним GROUP BY.
+
+    Возвращает количество исправленных счетчиков.
+    """
+    actual = dict(
+        Post.objects.filter(author__isnull=False).order_by().values(
+            'author_id'
+        ).annotate(total=Count('pk')).values_list('author_id', 'total')
+    )
+    stored = dict(AuthorStats.objects.values_list('user_id', 'post_count'))
+    fixed = 0
+    for author_id, count in stored.items():
+        if actual.get(author_id, 0) != count:
+            AuthorStats.objects.filter(user_id=author_id).update(
+                post_count=actual.get(author_id, 0)
+            )
+            fixed += 1
+    missing = [
+        AuthorStats(user_id=author_id, post_count=count)
+        for author_id, count in actual.items() if author_id not in stored
+    ]
+    AuthorStats.objects.bulk_create(missing, batch_size=500)
+    return fixed + len(missing)
+
+
+def change_comment_count(post_id, delta):
+    """Сдвигает счетчик комментариев записи на delta.
+
+    Вызывается из сигналов Comment внутри транзакции комментария.
+    """
+    if post_id is None:
+        return
+    Post.objects.filter(pk=post_id).update(
+        comment_count=Greatest(F('comment_count') + delta, 0)
+    )
+
+
+def actual_comment_count():
+    """Количество комментариев записи подзапросом по индексу
+    (post, -created)."""
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values(
+        'post'
+    ).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(comments), 0)
+
+
+def fill_comment_counts(first_pk, last_pk):
+    """Исправляет счетчики записей с id от first_pk до last_pk,
+    разошедшиеся с комментариями.
+
+    Расхождения ищутся одним SELECT и исправляются одним UPDATE.
+    Исправленные записи сбрасываются из кэша объектов вместе со
+    страницами, где выводятся их счетчики.
+
+    Возвращает количество исправленных записей.
+    """
+    stale = list(
+        Post.objects.filter(pk__range=(first_pk, last_pk)).annotate(
+            actual=actual_comment_count()
+        ).exclude(comment_count=F('actual')).values_list(
+            'pk', 'author__username', 'group__slug'
+        )
+    )
+    if not stale:
+        return 0
+    post_ids = [post_id for post_id, _, _ in stale]
+    Post.objects.filter(pk__in=post_ids).update(
+        comment_count=actual_comment_count()
+    )
+    forget_entities(Post, post_ids)
+    bump_generation(
+        POSTS,
+        *(post_generation(post_id) for post_id in post_ids),
+        *{profile_generation(name) for _, name, _ in stale if name},
+        *{group_generation(slug) for _, _, slug in stale if slug},
+    )
+    return len(stale)
@@ -0,0 +1,323 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from django.http import Http404
+
+from core.bloom import BloomFilter
+from core.caching import initial_generation
+
+from .models import Group, Post, User
+
+# Поля пользователя, которые выводятся рядом с записями. Пароль и прочие
+# поля в кэш не попадают и при обращении дочитываются из базы.
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name')
+# Значение в ключе поиска: объекта нет.
+MISSING = 'missing'
+# Поля, по которым собираются фильтры существующих значений.
+LOOKUP_FILTERS = ((User, 'username'), (Group, 'slug'), (Post, 'pk'))
+
+# Копии фильтров в памяти процесса: {(model, field): (номер, фильтр)}.
+_local_filters = {}
+
+
+def entity_key(model, pk):
+    """Ключ кэша с объектом model."""
+    return f'posts:entity:{model._meta.model_name}:{pk}'
+
+
+def lookup_key(model, field, value):
+    """Ключ кэша с id объекта model по значению уникального поля."""
+    return f'posts:entity:{model._meta.model_name}:{field}:{value}'
+
+
+def entity_queryset(model):
+    if model is User:
+        return User.objects.only(*USER_FIELDS)
+    return model._default_manager.all()
+
+
+def get_entities(model, pks):
+    """Объекты model по id одним get_many из кэша.
+
+    Недостающие читаются из базы одним запросом и кладутся в кэш.
+    Возвращает словарь {id: объект} без несуществующих id.
+    """
+    keys = {entity_key(model, pk): pk for pk in set(pks)}
+    cached = cache.get_many(keys)
+    entities = {keys[key]: entity for key, entity in cached.items()}
+    missing = [pk for key, pk in keys.items() if key not in cached]
+    if missing:
+        found = entity_queryset(model).in_bulk(missing)
+        cache.set_many(
+            {entity_key(model, pk): entity for pk, entity in found.items()},
+            settings.ENTITY_CACHE_TIME
+        )
+        entities.update(found)
+    return entities
+
+
+def forget_entities(model, pks):
+    cache.delete_many([entity_key(model, pk) for pk in pks])
+
+
+def forget_lookups(model, field, values):
+    cache.delete_many([
+        lookup_key(model, field, value)
+        for value in values if value is not None
+    ])
+
+
+def not_found(model):
+    return Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+def to_pk(model, value):
+    """id из URL. Для нечислового значения - 404, а не ошибка."""
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        raise not_found(model)
+
+
+def lookup_filter_key(model, field):
+    """Ключ кэша с фильтром существующих значений поля model."""
+    return f'posts:lookup-filter:{model._meta.model_name}:{field}'
+
+
+def lookup_filter_version_key(model, field):
+    """Ключ кэша с номером изменения значений поля после сборки фильтра."""
+    return f'{lookup_filter_key(model, field)}:version'
+
+
+def get_filter_version(model, field):
+    """Номер изменения значений поля.
+
+    Заводится от времени, как поколение (см. initial_generation):
+    после вытеснения ключа номер не повторит прежний, с которым
+    процессы держат копии фильтра.
+    """
+    key = lookup_filter_version_key(model, field)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_generation(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def build_lookup_filter(model, field):
+    """Фильтр Блума по значениям поля, для id - наибольший id."""
+    manager = model._default_manager
+    if field == 'pk':
+        return manager.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+    values = manager.values_list(field, flat=True)
+    return BloomFilter.from_values(
+        values.iterator(), values.count(), settings.LOOKUP_FILTER_ERROR_RATE
+    )
+
+
+def store_filter_unless_changed(model, field, lookup_filter, version):
+    """Кладет фильтр в кэш вместе с version, если с нее значения поля
+    не менялись.
+
+    Проверка повторяется после записи: если пока фильтр писали, значение
+    добавили, фильтр удаляется и будет собран заново.
+    """
+    key = lookup_filter_key(model, field)
+    if get_filter_version(model, field) != version:
+        return False
+    cache.set(key, (version, lookup_filter), settings.LOOKUP_FILTER_TIME)
+    if get_filter_version(model, field) != version:
+        cache.delete(key)
+        return False
+    return True
+
+
+def store_lookup_filter(model, field):
+    """Собирает и кладет в кэш фильтр, возвращает (номер, фильтр).
+    Если пока он собирался, появились новые значения, возвращает None."""
+    version = get_filter_version(model, field)
+    lookup_filter = build_lookup_filter(model, field)
+    if not store_filter_unless_changed(model, field, lookup_filter, version):
+        return None
+    return version, lookup_filter
+
+
+def get_lookup_filter(model, field):
+    """(номер, фильтр) из кэша. Пропавший фильтр собирает один запрос,
+    остальные пока обходятся без него."""
+    key = lookup_filter_key(model, field)
+    lookup_filter = cache.get(key)
+    if lookup_filter is None and cache.add(
+        f'{key}.lock', 1, settings.CACHE_LOCK_TIMEOUT
+    ):
+        try:
+            lookup_filter = store_lookup_filter(model, field)
+        finally:
+            cache.delete(f'{key}.lock')
+    return lookup_filter
+
+
+def add_to_lookup_filter(model, field, value):
+    """Добавляет значение в собранный фильтр.
+
+    Номер изменения растет до обновления: фильтр, который в это время
+    собирается или обновляется другим процессом, не будет сохранен
+    без значения. Если фильтр занят, он просто удаляется.
+    """
+    key = lookup_filter_key(model, field)
+    version_key = lookup_filter_version_key(model, field)
+    cache.add(version_key, initial_generation(), None)
+    try:
+        version = cache.incr(version_key)
+    except ValueError:
+        cache.delete(key)
+        return
+    if not cache.add(f'{key}.lock', 1, settings.CACHE_LOCK_TIMEOUT):
+        cache.delete(key)
+        return
+    try:
+        stored = cache.get(key)
+        if stored is None:
+            return
+        _, lookup_filter = stored
+        if field == 'pk':
+            lookup_filter = max(lookup_filter, value)
+        else:
+            lookup_filter.add(value)
+        store_filter_unless_changed(model, field, lookup_filter, version)
+    finally:
+        cache.delete(f'{key}.lock')
+
+
+def get_local_filter(model, field):
+    """Фильтр из памяти процесса.
+
+    Из кэша он перечитывается, только когда меняется номер изменения
+    значений поля, а не на каждый промах: с общим кэшем это чтение
+    и распаковка всего фильтра.
+    """
+    version = get_filter_version(model, field)
+    local = _local_filters.get((model, field))
+    if local is not None and local[0] == version:
+        return local[1]
+    stored = get_lookup_filter(model, field)
+    if stored is None:
+        return None
+    _local_filters[(model, field)] = stored
+    return stored[1]
+
+
+def remember_created(model, field, value):
+    """Отмечает в фильтре новое значение поля после коммита, когда
+    объект уже виден фильтру, который соберут заново."""
+    if settings.LOOKUP_FILTER_ENABLED and (model, field) in LOOKUP_FILTERS:
+        transaction.on_commit(
+            lambda: add_to_lookup_filter(model, field, value)
+        )
+
+
+def is_missing(model, field, value):
+    """Объекта точно нет, и это известно без запроса к базе.
+
+    Сначала проверяется кэш прошлых промахов, затем, если включен
+    LOOKUP_FILTER_ENABLED, фильтр по LOOKUP_FILTERS: фильтр Блума
+    для имен и адресов, диапазон для id записей. Новые значения
+    добавляются в фильтр при создании объектов (см. remember_created).
+    """
+    if cache.get(lookup_key(model, field, value)) == MISSING:
+        return True
+    if (
+        not settings.LOOKUP_FILTER_ENABLED
+        or (model, field) not in LOOKUP_FILTERS
+    ):
+        return False
+    lookup_filter = get_local_filter(model, field)
+    if lookup_filter is None:
+        return False
+    if field == 'pk':
+        return value > lookup_filter
+    return value not in lookup_filter
+
+
+def remember_missing(model, field, value):
+    cache.set(
+        lookup_key(model, field, value), MISSING, settings.NEGATIVE_CACHE_TIME
+    )
+
+
+def get_entity_or_404(model, **lookup):
+    """get_object_or_404 по id или уникальному полю через кэш объектов.
+
+    Для поля кроме id в кэше хранится еще и id объекта по значению поля.
+    Несуществующие объекты отсекаются без базы (см. is_missing),
+    а промахи запоминаются на NEGATIVE_CACHE_TIME.
+    """
+    (field, value), = lookup.items()
+    if field in ('pk', 'id'):
+        field, value = 'pk', to_pk(model, value)
+        pk = value
+    else:
+        pk = cache.get(lookup_key(model, field, value))
+    if pk == MISSING:
+        raise not_found(model)
+    if pk is not None:
+        entity = cache.get(entity_key(model, pk))
+        if entity is not None and getattr(entity, field) == value:
+            return entity
+    if is_missing(model, field, value):
+        raise not_found(model)
+    entity = entity_queryset(model).filter(**{field: value}).first()
+    if entity is None:
+        remember_missing(model, field, value)
+        raise not_found(model)
+    values = {entity_key(model, entity.pk): entity}
+    if field != 'pk':
+        values[lookup_key(model, field, value)] = entity.pk
+    cache.set_many(values, settings.ENTITY_CACHE_TIME)
+    return entity
+
+
+def get_post_or_404(post_id):
+    """Запись с автором и группой из кэша объектов."""
+    return with_relations([get_entity_or_404(Post, pk=post_id)])[0]
+
+
+def entity_exists(model, pk):
+    """Проверка, что объект есть, без чтения его строки из базы."""
+    pk = to_pk(model, pk)
+    if cache.has_key(entity_key(model, pk)):
+        return True
+    if is_missing(model, 'pk', pk):
+        return False
+    if model._default_manager.filter(pk=pk).exists():
+        return True
+    remember_missing(model, 'pk', pk)
+    return False
+
+
+def get_posts(post_ids):
+    """Записи с авторами и группами в порядке post_ids.
+
+    Записи, пользователи и группы кэшируются по отдельности, поэтому
+    правка записи или имени автора сбрасывает один объект, а не все
+    ленты, где он выводится.
+    """
+    posts = get_entities(Post, post_ids)
+    return with_relations([posts[pk] for pk in post_ids if pk in posts])
+
+
+def with_relations(posts):
+    """Подставляет в записи авторов и группы из кэша объектов."""
+    authors = get_entities(User, {post.author_id for post in posts})
+    groups = get_entities(Group, {
+        post.group_id for post in posts if post.group_id is not None
+    })
+    for post in posts:
+        if post.author_id in authors:
+            post.author = authors[post.author_id]
+        if post.group_id is not None:
+            # Группу могли удалить: база обнулила group_id без сигналов.
+            post.group = groups.get(post.group_id)
+    return posts
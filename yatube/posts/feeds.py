@@ -0,0 +1,259 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.caching import renew_generations, viewer_generation
+
+from .entities import get_posts
+from .models import FeedEntry, Follow, FollowFeedCursor, Post
+
+INDEX_FEED = 'index'
+FOLLOW_FEED_MATERIALIZED = 'materialized'
+FOLLOW_FEED_MERGE = 'merge'
+
+
+def group_feed(group_id):
+    """Имя ленты сообщества."""
+    return f'group:{group_id}'
+
+
+def author_feed(author_id):
+    """Имя ленты автора."""
+    return f'author:{author_id}'
+
+
+def follow_feed(user_id):
+    """Имя ленты подписок пользователя."""
+    return f'follow:{user_id}'
+
+
+def post_feeds(post):
+    """Ленты, в которые попадает запись."""
+    feeds = [INDEX_FEED, author_feed(post.author_id)]
+    if post.group_id is not None:
+        feeds.append(group_feed(post.group_id))
+    return feeds
+
+
+def feed_ids_key(feed):
+    """Ключ кэша с id первых записей ленты."""
+    return f'posts:ids:{feed}'
+
+
+def get_feed_ids(feed, post_list):
+    """id первых FEED_IDS_SIZE записей ленты в порядке вывода.
+
+    Сами записи берутся из кэша объектов (см. entities.get_posts),
+    поэтому список id сбрасывается только при добавлении и удалении
+    записей ленты, а не при их правке.
+    """
+    return cache.get_or_set(
+        feed_ids_key(feed),
+        lambda: list(
+            post_list.values_list('pk', flat=True)[:settings.FEED_IDS_SIZE]
+        ),
+        settings.FEED_IDS_CACHE_TIME
+    )
+
+
+def forget_feed_ids(feeds):
+    cache.delete_many([feed_ids_key(feed) for feed in feeds])
+
+
+def is_materialized():
+    """Лента подписок собирается из таблицы FeedEntry."""
+    return settings.FOLLOW_FEED_ENGINE == FOLLOW_FEED_MATERIALIZED
+
+
+def push_to_followers(post):
+    """Раскладывает новую запись по лентам подписчиков автора."""
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, post=post, author_id=post.author_id,
+                pub_date=post.pub_date
+            )
+            for user_id in Follow.objects.filter(
+                author_id=post.author_id
+            ).values_list('user_id', flat=True).iterator()
+        ),
+        batch_size=500,
+        ignore_conflicts=True
+    )
+
+
+def backfill_follow_feed(user_id, author_id):
+    """Добавляет в ленту подписчика последние записи автора."""
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )[:settings.FOLLOW_FEED_BACKFILL]
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, post_id=post_id, author_id=author_id,
+                pub_date=pub_date
+            )
+            for post_id, pub_date in posts
+        ),
+        batch_size=500,
+        ignore_conflicts=True
+    )
+
+
+def drop_from_follow_feed(user_id, author_id):
+    """Убирает записи автора из ленты бывшего подписчика."""
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild_follow_feed(user_id):
+    """Собирает ленту подписок пользователя заново."""
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    for author_id in Follow.objects.filter(
+        user_id=user_id
+    ).values_list('author_id', flat=True).distinct():
+        backfill_follow_feed(user_id, author_id)
+
+
+def follow_feed_posts(user):
+    """Записи ленты подписок выбранным в FOLLOW_FEED_ENGINE способом.
+
+    materialized: одно чтение по индексу (user, -pub_date) FeedEntry,
+    merge: слияние закэшированных лент авторов, на которых подписан user.
+    """
+    if not is_materialized():
+        return MergedTimeline(
+            Follow.objects.filter(user=user).values_list(
+                'author_id', flat=True
+            )
+        )
+    return Post.objects.filter(feed_entries__user=user).select_related(
+        'author', 'group'
+    ).order_by('-feed_entries__pub_date')
+
+
+def timeline_key(author_id):
+    """Ключ кэша с последними записями автора."""
+    return f'posts:timeline:{author_id}'
+
+
+def get_timelines(author_ids):
+    """Последние записи авторов: списки (pub_date, id) от новых к старым.
+
+    Недостающие в кэше ленты читаются из базы одним запросом
+    и кладутся в кэш.
+    """
+    keys = {timeline_key(author_id): author_id for author_id in author_ids}
+    timelines = cache.get_many(keys)
+    missing = {key: [] for key in keys if key not in timelines}
+    if missing:
+        rows = Post.objects.filter(
+            author_id__in=[keys[key] for key in missing]
+        ).order_by('author_id', '-pub_date', '-pk').values_list(
+            'author_id', 'pub_date', 'pk'
+        )
+        for author_id, pub_date, pk in rows.iterator():
+            timeline = missing[timeline_key(author_id)]
+            if len(timeline) < settings.FOLLOW_TIMELINE_SIZE:
+                timeline.append((pub_date, pk))
+        cache.set_many(missing, settings.FOLLOW_TIMELINE_CACHE_TIME)
+        timelines.update(missing)
+    return list(timelines.values())
+
+
+def push_to_timeline(post):
+    """Добавляет новую запись в закэшированную ленту автора."""
+    key = timeline_key(post.author_id)
+    timeline = cache.get(key)
+    if timeline is not None:
+        timeline.insert(0, (post.pub_date, post.pk))
+        cache.set(
+            key, timeline[:settings.FOLLOW_TIMELINE_SIZE],
+            settings.FOLLOW_TIMELINE_CACHE_TIME
+        )
+
+
+def forget_timeline(author_id):
+    cache.delete(timeline_key(author_id))
+
+
+class MergedTimeline:
+    """Лента подписок как k-way слияние лент авторов через кучу.
+
+    Поддерживает count() и срезы, поэтому подходит для Paginator.
+    """
+
+    def __init__(self, author_ids):
+        self.author_ids = author_ids
+
+    def timelines(self):
+        if not hasattr(self, '_timelines'):
+            self._timelines = get_timelines(self.author_ids)
+        return self._timelines
+
+    def count(self):
+        return sum(len(timeline) for timeline in self.timelines())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        merged = heapq.merge(*self.timelines(), reverse=True)
+        post_ids = [
+            pk for pub_date, pk in islice(merged, index.start, index.stop)
+        ]
+        return get_posts(post_ids)
+
+
+def unread_key(user_id):
+    """Ключ кэша со счетчиком непрочитанных записей ленты подписок."""
+    return f'posts:unread:{user_id}'
+
+
+def unread_count(user):
+    """Количество новых записей в ленте подписок.
+
+    Обычно это одно чтение из кэша. Публикация сбрасывает счетчики
+    подписчиков одним delete_many, и они пересчитываются от курсора
+    при следующем показе.
+    """
+    count = cache.get(unread_key(user.pk))
+    if count is None:
+        posts = Post.objects.filter(author__following__user=user)
+        cursor = FollowFeedCursor.objects.filter(user=user).first()
+        if cursor is not None:
+            posts = posts.filter(pub_date__gt=cursor.pub_date)
+        # Порядок не важен для количества, а без него не нужна сортировка.
+        count = posts.order_by()[:settings.FOLLOW_UNREAD_LIMIT].count()
+        cache.set(
+            unread_key(user.pk), count, settings.FOLLOW_UNREAD_CACHE_TIME
+        )
+    return count
+
+
+def forget_unread(user_ids):
+    cache.delete_many([unread_key(user_id) for user_id in user_ids])
+    forget_viewer_pages(user_ids)
+
+
+def forget_viewer_pages(user_ids):
+    """Сбрасывает закэшированные страницы пользователей: в их шапке
+    старое число новых записей."""
+    renew_generations(*(viewer_generation(user_id) for user_id in user_ids))
+
+
+def mark_follow_feed_seen(user, page_obj):
+    """Сдвигает курсор прочитанного на первую запись первой страницы."""
+    if page_obj.has_previous():
+        return
+    if cache.get(unread_key(user.pk)) == 0:
+        return
+    if page_obj:
+        FollowFeedCursor.objects.update_or_create(
+            user=user, defaults={'pub_date': page_obj[0].pub_date}
+        )
+    cache.set(unread_key(user.pk), 0, settings.FOLLOW_UNREAD_CACHE_TIME)
+    forget_viewer_pages([user.pk])
@@ -0,0 +1,87 @@
+from django.core.cache import cache
+
+from .entities import is_missing, remember_missing
+from .models import Post
+
+POSTS = 'posts'
+GROUPS = 'groups'
+
+
+def group_generation(slug):
+    """Поколение страниц сообщества."""
+    return f'group:{slug}'
+
+
+def profile_generation(username):
+    """Поколение страниц профиля."""
+    return f'profile:{username}'
+
+
+def post_generation(post_id):
+    """Поколение страницы записи."""
+    return f'post:{post_id}'
+
+
+def author_generation(author_id):
+    """Поколение страниц всех записей автора."""
+    return f'author:{author_id}'
+
+
+def user_generation(user_id):
+    """Поколение всего, где выводится имя пользователя."""
+    return f'user:{user_id}'
+
+
+def group_info_generation(group_id):
+    """Поколение всего, где выводятся название и адрес группы."""
+    return f'group-info:{group_id}'
+
+
+def post_card_generations(post):
+    """Поколения карточки записи в ленте."""
+    names = [post_generation(post.pk), user_generation(post.author_id)]
+    if post.group_id is not None:
+        names.append(group_info_generation(post.group_id))
+    return names
+
+
+def post_author_key(post_id):
+    return f'posts:post-author:{post_id}'
+
+
+def post_author_id(post_id):
+    """Автор записи. Автор меняется редко (в админке), поэтому хранится
+    долго и сбрасывается сигналом (см. forget_post_author).
+
+    Несуществующая запись отсекается без базы (см. is_missing), а ее
+    промах запоминается: роботы перебирают большие id.
+    """
+    key = post_author_key(post_id)
+    author_id = cache.get(key)
+    if author_id is not None or is_missing(Post, 'pk', post_id):
+        return author_id
+    row = Post.objects.filter(pk=post_id).values_list('author_id').first()
+    if row is None:
+        remember_missing(Post, 'pk', post_id)
+        return None
+    cache.set(key, row[0], None)
+    return row[0]
+
+
+def forget_post_author(post_id):
+    cache.delete(post_author_key(post_id))
+
+
+def group_page_generations(slug):
+    return (group_generation(slug),)
+
+
+def profile_page_generations(username):
+    return (profile_generation(username), GROUPS)
+
+
+def post_page_generations(post_id):
+    author_id = post_author_id(post_id)
+    if author_id is None:
+        return (post_generation(post_id),)
+    return (post_generation(post_id), author_generation(author_id), GROUPS)
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from posts.counters import fill_comment_counts
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Исправляет счетчики комментариев записей пачками по диапазонам '
+        'id, каждая пачка - один SELECT и один UPDATE. Запускается после '
+        'миграции, добавившей счетчик, и для исправления расхождений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько id записей пересчитывать за один запрос'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Пауза между пачками в секундах, чтобы не мешать сайту'
+        )
+        parser.add_argument(
+            '--start', type=int, default=None,
+            help='С какого id продолжить прерванный пересчет'
+        )
+
+    def handle(self, *args, **options):
+        edges = Post.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if edges['first'] is None:
+            self.stdout.write(self.style.SUCCESS('Записей нет'))
+            return
+        batch_size = options['batch_size']
+        first = max(options['start'] or edges['first'], edges['first'])
+        updated = 0
+        while first <= edges['last']:
+            last = first + batch_size - 1
+            updated += fill_comment_counts(first, last)
+            self.stdout.write(f'Пересчитаны записи с id {first}-{last}')
+            first = last + 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков комментариев: {updated}'
+        ))
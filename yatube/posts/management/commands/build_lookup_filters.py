@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.entities import LOOKUP_FILTERS, store_lookup_filter
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново собирает фильтры существующих имен пользователей, адресов '
+        'групп и id записей. Запускается по расписанию чаще, чем '
+        'LOOKUP_FILTER_TIME, и после массовой загрузки данных'
+    )
+
+    def handle(self, *args, **options):
+        for model, field in LOOKUP_FILTERS:
+            store_lookup_filter(model, field)
+        self.stdout.write(self.style.SUCCESS(
+            f'Собрано фильтров: {len(LOOKUP_FILTERS)}'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import author_feed, group_feed
+from posts.models import PageBoundary, Post
+from posts.paginators import extend_boundaries
+
+
+class Command(BaseCommand):
+    help = 'Заново строит индекс границ страниц для лент групп и авторов'
+
+    def handle(self, *args, **options):
+        PageBoundary.objects.all().delete()
+        feeds = [
+            (group_feed(group_id), Post.objects.filter(group_id=group_id))
+            for group_id in Post.objects.filter(
+                group__isnull=False
+            ).order_by().values_list('group_id', flat=True).distinct()
+        ] + [
+            (author_feed(author_id), Post.objects.filter(author_id=author_id))
+            for author_id in Post.objects.filter(
+                author__isnull=False
+            ).order_by().values_list('author_id', flat=True).distinct()
+        ]
+        for feed, post_list in feeds:
+            extend_boundaries(feed, post_list)
+        self.stdout.write(self.style.SUCCESS(
+            f'Построены границы для {len(feeds)} лент: '
+            f'{PageBoundary.objects.count()}'
+        ))
@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.feeds import rebuild_follow_feed
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пользователи, чьи ленты нужно пересобрать (по умолчанию все)'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        rebuilt = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            rebuild_follow_feed(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано лент подписок: {rebuilt}'
+        ))
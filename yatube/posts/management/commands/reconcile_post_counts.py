@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_post_counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики записей авторов с таблицей записей и исправляет '
+        'расхождения. Запускается по расписанию в тихие часы'
+    )
+
+    def handle(self, *args, **options):
+        fixed = reconcile_post_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков записей: {fixed}'
+        ))
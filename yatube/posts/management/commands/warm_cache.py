@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.warmup import warm_urls, warmup_host
+from posts.warmup import warmup_urls
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает кэш страниц: первые страницы главной, самые большие '
+        'группы и профили с наибольшим числом подписчиков. Запускается '
+        'после выкладки. Кэш в памяти процесса (LocMemCache) этой '
+        'командой не прогреть, для него есть WARMUP_ON_STARTUP'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages', type=int, default=settings.WARMUP_PAGES,
+            help='Сколько страниц главной прогреть'
+        )
+        parser.add_argument(
+            '--groups', type=int, default=settings.WARMUP_GROUPS,
+            help='Сколько самых больших групп прогреть'
+        )
+        parser.add_argument(
+            '--profiles', type=int, default=settings.WARMUP_PROFILES,
+            help='Сколько самых популярных профилей прогреть'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.WARMUP_WORKERS,
+            help='Сколько страниц запрашивать одновременно'
+        )
+        parser.add_argument(
+            '--time-limit', type=float, default=settings.WARMUP_TIME_LIMIT,
+            help='Через сколько секунд не начинать новые запросы'
+        )
+        parser.add_argument(
+            '--host', default=None,
+            help='Хост сайта (по умолчанию WARMUP_HOST или ALLOWED_HOSTS)'
+        )
+
+    def handle(self, *args, **options):
+        urls = warmup_urls(
+            options['pages'], options['groups'], options['profiles']
+        )
+        host = options['host'] or warmup_host()
+        results = warm_urls(
+            urls, options['workers'], options['time_limit'], host
+        )
+        warmed = 0
+        for url, status, seconds in results:
+            if status is None and seconds is None:
+                self.stdout.write(f'{url}: пропущено, вышло время')
+            elif status != 200:
+                self.stdout.write(self.style.WARNING(
+                    f'{url}: {status or "ошибка"} за {seconds:.3f} с'
+                ))
+            else:
+                warmed += 1
+                self.stdout.write(f'{url}: {seconds:.3f} с')
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето страниц {host}: {warmed} из {len(urls)}'
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_follow'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ('-created',), 'verbose_name': 'Комментарии', 'verbose_name_plural': 'Комментарии'},
+        ),
+        migrations.AlterModelOptions(
+            name='follow',
+            options={'verbose_name': 'Подписки', 'verbose_name_plural': 'Подписки'},
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='posts/', verbose_name='Изображение'),
+        ),
+        migrations.CreateModel(
+            name='PageBoundary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed', models.CharField(max_length=64, verbose_name='Лента')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер границы')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('post_id', models.PositiveIntegerField(verbose_name='Запись')),
+            ],
+            options={
+                'verbose_name': 'Граница страницы',
+                'verbose_name_plural': 'Границы страниц',
+                'unique_together': {('feed', 'number')},
+            },
+        ),
+    ]
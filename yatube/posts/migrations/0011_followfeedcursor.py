@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0010_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowFeedCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='follow_feed_cursor', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Прочитанное в ленте подписок',
+                'verbose_name_plural': 'Прочитанное в ленте подписок',
+            },
+        ),
+    ]
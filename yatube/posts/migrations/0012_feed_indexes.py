@@ -0,0 +1,51 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    """Оставляет по одной подписке на пару (user, author)."""
+    Follow = apps.get_model('posts', 'Follow')
+    duplicates = Follow.objects.values('user', 'author').annotate(
+        first=Min('pk'), total=Count('pk')
+    ).filter(total__gt=1)
+    for pair in duplicates:
+        Follow.objects.filter(
+            user=pair['user'], author=pair['author']
+        ).exclude(pk=pair['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_followfeedcursor'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_follows, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together={('user', 'author')},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created'], name='posts_comme_post_id_581ffd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-pub_date'], name='posts_post_pub_dat_efcc38_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-pub_date'], name='posts_post_author__7827da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-pub_date'], name='posts_post_group_i_1fdac4_idx'),
+        ),
+    ]
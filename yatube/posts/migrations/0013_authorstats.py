@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_author_stats(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    AuthorStats.objects.bulk_create(
+        (
+            AuthorStats(user_id=author_id, post_count=total)
+            for author_id, total in Post.objects.filter(
+                author__isnull=False
+            ).order_by().values('author_id').annotate(
+                total=Count('pk')
+            ).values_list('author_id', 'total')
+        ),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0012_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='author_stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('post_count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+            ],
+            options={
+                'verbose_name': 'Статистика автора',
+                'verbose_name_plural': 'Статистика авторов',
+            },
+        ),
+        migrations.RunPython(fill_author_stats, migrations.RunPython.noop),
+    ]
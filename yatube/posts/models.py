@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 
+from core.querycache import CachedQuerySet
 
 User = get_user_model()
 
@@ -32,15 +33,42 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Комментариев'
+    )
+
+    objects = CachedQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date']),
+            models.Index(fields=['author', '-pub_date']),
+            models.Index(fields=['group', '-pub_date']),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        # Счетчик комментариев меняют только UPDATE из сигналов Comment:
+        # правка записи, взятой из кэша объектов, не затирает его
+        # устаревшим значением.
+        if not self._state.adding and not args and kwargs.get(
+            'update_fields'
+        ) is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'comment_count'
+            ]
+        # Счетчик записей автора (см. posts.counters) обновляется
+        # сигналом post_save в одной транзакции с записью, а кэш
+        # сбрасывается после коммита (см. posts.signals.after_commit).
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Group(models.Model):
     title = models.CharField(unique=True, max_length=200,
@@ -48,6 +76,8 @@ class Group(models.Model):
     slug = models.SlugField(unique=True, verbose_name='Адрес')
     description = models.TextField(verbose_name='Описание')
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'Группы'
 
@@ -77,11 +107,22 @@ class Comment(models.Model):
     created = models.DateTimeField(auto_now_add=True,
                                    verbose_name='Дата публикации')
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['post', '-created']),
+        ]
         verbose_name = 'Комментарии'
         verbose_name_plural = 'Комментарии'
 
+    def save(self, *args, **kwargs):
+        # Счетчик комментариев записи обновляется в той же транзакции,
+        # а кэш сбрасывается после коммита.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -97,6 +138,88 @@ class Follow(models.Model):
         verbose_name='Объект подписки'
     )
 
+    objects = CachedQuerySet.as_manager()
+
     class Meta:
+        unique_together = ('user', 'author')
         verbose_name = 'Подписки'
         verbose_name_plural = 'Подписки'
+
+
+class PageBoundary(models.Model):
+    """Граница страницы ленты: каждая VISIBLE_POSTS-я запись от старых."""
+    feed = models.CharField(max_length=64, verbose_name='Лента')
+    number = models.PositiveIntegerField(verbose_name='Номер границы')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+    post_id = models.PositiveIntegerField(verbose_name='Запись')
+
+    class Meta:
+        unique_together = ('feed', 'number')
+        verbose_name = 'Граница страницы'
+        verbose_name_plural = 'Границы страниц'
+
+
+class FeedEntry(models.Model):
+    """Запись в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Запись'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date',)
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-pub_date']),
+            models.Index(fields=['user', 'author']),
+        ]
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Лента подписок'
+
+
+class FollowFeedCursor(models.Model):
+    """Самая новая запись ленты подписок, которую видел пользователь."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_feed_cursor',
+        verbose_name='Подписчик'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Прочитанное в ленте подписок'
+        verbose_name_plural = 'Прочитанное в ленте подписок'
+
+
+class AuthorStats(models.Model):
+    """Счетчики автора, которые иначе считались бы COUNT на каждый показ."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='author_stats',
+        verbose_name='Автор'
+    )
+    post_count = models.PositiveIntegerField(
+        default=0, verbose_name='Записей'
+    )
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
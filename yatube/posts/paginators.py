@@ -0,0 +1,356 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Max, Min, Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .entities import get_posts
+from .feeds import get_feed_ids
+from .models import PageBoundary
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+
+
+def encode_cursor(direction, post):
+    """Упаковывает ключ (pub_date, id) записи в строку для URL."""
+    raw = f'{direction}|{post.pub_date.isoformat()}|{post.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор. Возвращает None для битого значения."""
+    try:
+        raw = base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)
+        ).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS) or pub_date is None:
+        return None
+    return direction, pub_date, pk
+
+
+def count_key(feed):
+    """Ключ кэша с количеством записей ленты."""
+    return f'posts:count:{feed}'
+
+
+def incr_count(feeds, delta=1):
+    """Сдвигает закэшированные счетчики лент на delta.
+
+    Незакэшированные счетчики не трогаем: их посчитает пагинатор.
+    """
+    for feed in feeds:
+        try:
+            cache.incr(count_key(feed), delta)
+        except ValueError:
+            pass
+
+
+def forget_count(feeds):
+    """Сбрасывает закэшированные счетчики лент."""
+    cache.delete_many([count_key(feed) for feed in feeds])
+
+
+class CountingPaginator(Paginator):
+    """Paginator, который не делает COUNT на каждый запрос.
+
+    Количество записей ленты feed хранится в кэше и обновляется
+    сигналами при создании и удалении записей. Ленты меньше
+    PAGINATOR_COUNT_CACHE_FROM считаются заново (это дешево),
+    для лент больше PAGINATOR_COUNT_ESTIMATE_FROM количество оценивается.
+
+    Страницы из первых FEED_IDS_SIZE записей ленты собираются
+    из закэшированного списка id и кэша объектов, без запросов к базе.
+
+    Если количество уже известно (например, из счетчика записей
+    автора), его передают в known_count.
+    """
+
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, feed=None, known_count=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.feed = feed
+        self.known_count = known_count
+
+    def _get_page(self, *args, **kwargs):
+        page = super()._get_page(*args, **kwargs)
+        page.elided_page_range = list(
+            self.get_elided_page_range(page.number)
+        )
+        return page
+
+    def get_elided_page_range(self, number=1, on_each_side=3, on_ends=2):
+        """Номера страниц вокруг текущей, первые и последние страницы.
+
+        Пропуски обозначаются ELLIPSIS, длина не зависит от num_pages.
+        """
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1, self.num_pages + 1)
+        else:
+            yield from range(number + 1, self.num_pages + 1)
+
+    def is_feed(self):
+        return (
+            isinstance(self.object_list, QuerySet)
+            and self.feed is not None
+            and self.object_list._result_cache is None
+        )
+
+    @cached_property
+    def feed_ids(self):
+        return get_feed_ids(self.feed, self.object_list)
+
+    def is_feed_ids_complete(self):
+        """В закэшированном списке id вся лента."""
+        return len(self.feed_ids) < settings.FEED_IDS_SIZE
+
+    def page(self, number):
+        if not self.is_feed():
+            return self.page_from_db(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        if top > len(self.feed_ids) and not self.is_feed_ids_complete():
+            return self.page_from_db(number)
+        return self._get_page(
+            get_posts(self.feed_ids[bottom:top]), number, self
+        )
+
+    def page_from_db(self, number):
+        return super().page(number)
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        if not self.is_feed():
+            return super().count
+        if self.is_feed_ids_complete():
+            return len(self.feed_ids)
+        count = cache.get(count_key(self.feed))
+        if count is not None:
+            return max(count, 0)
+        limit = settings.PAGINATOR_COUNT_ESTIMATE_FROM
+        count = self.object_list[:limit + 1].count()
+        if count > limit:
+            count = self.estimate_count(limit)
+        if count >= settings.PAGINATOR_COUNT_CACHE_FROM:
+            cache.set(
+                count_key(self.feed), count,
+                settings.PAGINATOR_COUNT_CACHE_TIME
+            )
+        return count
+
+    def estimate_count(self, sample_size):
+        """Оценка по плотности id среди последних sample_size записей."""
+        pks = self.object_list.order_by('-pk').values_list('pk', flat=True)
+        sample_pk = pks[sample_size]
+        edges = self.object_list.order_by().aggregate(
+            min_pk=Min('pk'), max_pk=Max('pk')
+        )
+        sample_span = edges['max_pk'] - sample_pk
+        total_span = edges['max_pk'] - edges['min_pk']
+        if sample_span <= 0:
+            return sample_size + 1
+        return max(sample_size * total_span // sample_span, sample_size + 1)
+
+
+def not_older_than(pub_date, pk, pk_field='pk'):
+    """Условие (pub_date, pk) >= заданного ключа."""
+    return Q(pub_date__gt=pub_date) | Q(
+        pub_date=pub_date, **{f'{pk_field}__gte': pk}
+    )
+
+
+def truncate_boundaries(feed, pub_date, pk):
+    """Удаляет границы, позиции которых сдвинулись из-за записи."""
+    PageBoundary.objects.filter(feed=feed).filter(
+        not_older_than(pub_date, pk, 'post_id')
+    ).delete()
+
+
+def extend_boundaries(feed, post_list):
+    """Досчитывает границы ленты от последней известной до новейшей записи.
+
+    Граница number стоит на позиции number * VISIBLE_POSTS,
+    если считать записи от самой старой. Границы, которые уже досчитал
+    параллельный запрос, пропускаются.
+    """
+    step = settings.VISIBLE_POSTS
+    last = PageBoundary.objects.filter(feed=feed).order_by('-number').first()
+    keys = post_list.order_by('pub_date', 'pk').values_list('pub_date', 'pk')
+    first_number = 0
+    if last is not None:
+        keys = keys.filter(not_older_than(last.pub_date, last.post_id))
+        first_number = last.number
+    PageBoundary.objects.bulk_create(
+        (
+            PageBoundary(
+                feed=feed, number=first_number + position // step,
+                pub_date=pub_date, post_id=pk
+            )
+            for position, (pub_date, pk) in enumerate(keys.iterator())
+            if position % step == 0 and (last is None or position)
+        ),
+        batch_size=500,
+        ignore_conflicts=True
+    )
+
+
+def reindex_boundaries(feed, post_list, post):
+    """Пересчитывает границы ленты начиная с записи post."""
+    truncate_boundaries(feed, post.pub_date, post.pk)
+    extend_boundaries(feed, post_list)
+
+
+class BoundaryPaginator(CountingPaginator):
+    """Paginator, который открывает ?page=N поиском по индексу границ.
+
+    Вместо OFFSET по всей ленте берется ближайшая граница страницы
+    и смещение от нее меньше VISIBLE_POSTS. Без индекса работает
+    как CountingPaginator.
+    """
+
+    @cached_property
+    def last_boundary(self):
+        return PageBoundary.objects.filter(
+            feed=self.feed
+        ).order_by('-number').first()
+
+    @cached_property
+    def count(self):
+        last = self.last_boundary
+        if (
+            last is None or self.known_count is not None
+            or self.is_feed() and self.is_feed_ids_complete()
+        ):
+            return super().count
+        tail = self.object_list.filter(
+            not_older_than(last.pub_date, last.post_id)
+        )
+        return last.number * settings.VISIBLE_POSTS + tail.count()
+
+    def page_from_db(self, number):
+        number = self.validate_number(number)
+        end = self.count - (number - 1) * self.per_page
+        start = max(end - self.per_page, 0)
+        boundary = PageBoundary.objects.filter(
+            feed=self.feed, number__lte=start // settings.VISIBLE_POSTS
+        ).order_by('-number').first()
+        if boundary is None:
+            return super().page_from_db(number)
+        offset = start - boundary.number * settings.VISIBLE_POSTS
+        posts = self.object_list.filter(
+            not_older_than(boundary.pub_date, boundary.post_id)
+        ).order_by('pub_date', 'pk')[offset:offset + end - start]
+        return self._get_page(list(posts)[::-1], number, self)
+
+
+class CursorPage(Page):
+    """Страница keyset-пагинации. Номера страниц и COUNT не нужны."""
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        super().__init__(object_list, None, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return ''
+        return encode_cursor(CURSOR_NEXT, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return ''
+        return encode_cursor(CURSOR_PREVIOUS, self.object_list[0])
+
+
+class CursorPaginator(Paginator):
+    """Пагинация по ключу (pub_date, id) вместо OFFSET/LIMIT.
+
+    Соседние страницы выбираются условием по ключу последней
+    (или первой) записи, поэтому новые записи не сдвигают ленту.
+    """
+    ordering = ('-pub_date', '-pk')
+
+    def __init__(self, object_list, per_page):
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+
+    def get_page(self, cursor):
+        return self.page(cursor)
+
+    def page(self, cursor):
+        key = decode_cursor(cursor) if cursor else None
+        if key is None:
+            return self._first_page()
+        direction, pub_date, pk = key
+        if direction == CURSOR_NEXT:
+            return self._next_page(pub_date, pk)
+        return self._previous_page(pub_date, pk)
+
+    def _first_page(self):
+        posts = list(self.object_list[:self.per_page + 1])
+        return CursorPage(
+            posts[:self.per_page], self,
+            has_previous=False,
+            has_next=len(posts) > self.per_page,
+        )
+
+    def _next_page(self, pub_date, pk):
+        posts = list(self.object_list.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+        )[:self.per_page + 1])
+        return CursorPage(
+            posts[:self.per_page], self,
+            has_previous=True,
+            has_next=len(posts) > self.per_page,
+        )
+
+    def _previous_page(self, pub_date, pk):
+        posts = list(self.object_list.filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+        ).reverse()[:self.per_page + 1])
+        if len(posts) <= self.per_page:
+            return self._first_page()
+        return CursorPage(
+            posts[:self.per_page][::-1], self,
+            has_previous=True,
+            has_next=True,
+        )
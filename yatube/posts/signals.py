@@ -0,0 +1,412 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core.caching import bump_generation
+
+from .counters import change_comment_count, change_post_count
+from .entities import (forget_entities, forget_lookups, get_posts,
+                       remember_created)
+from .feeds import (author_feed, backfill_follow_feed, drop_from_follow_feed,
+                    follow_feed, forget_feed_ids, forget_timeline,
+                    forget_unread, group_feed, is_materialized, post_feeds,
+                    push_to_followers, push_to_timeline)
+from .generations import (GROUPS, POSTS, author_generation, forget_post_author,
+                          group_generation, group_info_generation,
+                          post_generation, profile_generation,
+                          user_generation)
+from .models import (Comment, FeedEntry, Follow, Group, PageBoundary, Post,
+                     User)
+from .paginators import forget_count, incr_count, reindex_boundaries
+
+USER_NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+_local = threading.local()
+
+
+def after_commit(func, *args):
+    """Кэш сбрасывается после коммита: сброс внутри транзакции дал бы
+    параллельному запросу снова закэшировать прежние данные."""
+    transaction.on_commit(lambda: func(*args))
+
+
+def follower_ids(author_id):
+    """Подписчики автора."""
+    return list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
+
+
+def reindex_author(author_id, post):
+    reindex_boundaries(
+        author_feed(author_id), Post.objects.filter(author_id=author_id), post
+    )
+
+
+def reindex_group(group_id, post):
+    if group_id is not None:
+        reindex_boundaries(
+            group_feed(group_id), Post.objects.filter(group_id=group_id), post
+        )
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    """Запоминает прежние группу и автора редактируемой записи."""
+    instance._previous_group_id = None
+    instance._previous_author_id = None
+    if instance.pk is not None:
+        instance._previous_group_id, instance._previous_author_id = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'author_id'
+            ).first() or (None, None)
+        )
+
+
+def username(user_id):
+    return User.objects.filter(pk=user_id).values_list(
+        'username', flat=True
+    ).first()
+
+
+def author_username(post):
+    if Post.author.is_cached(post):
+        return getattr(post.author, 'username', None)
+    return username(post.author_id)
+
+
+def previous_author_id(post):
+    """Прежний автор записи, если его сменили при редактировании."""
+    previous = getattr(post, '_previous_author_id', None)
+    if previous != post.author_id:
+        return previous
+    return None
+
+
+def object_feed_generations(post, group_ids=None):
+    """Поколения лент автора и групп group_ids (по умолчанию группы
+    записи), в которых выводится запись."""
+    if group_ids is None:
+        slugs = [post.group.slug] if post.group is not None else []
+    else:
+        slugs = Group.objects.filter(pk__in=group_ids).values_list(
+            'slug', flat=True
+        )
+    return [
+        profile_generation(author_username(post)),
+        *(group_generation(slug) for slug in slugs),
+    ]
+
+
+def feed_page_generations(post, group_ids=None):
+    """Поколения лент, в которых выводится запись: главная, профиль
+    автора и группы."""
+    return [POSTS, *object_feed_generations(post, group_ids)]
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_pages_changed(sender, instance, **kwargs):
+    """Сбрасывает страницы, на которых видна запись."""
+    group_ids = {
+        instance.group_id, getattr(instance, '_previous_group_id', None)
+    } - {None}
+    names = [
+        post_generation(instance.pk),
+        author_generation(instance.author_id),
+        *feed_page_generations(instance, group_ids),
+    ]
+    previous_author = previous_author_id(instance)
+    if previous_author is not None:
+        names += [
+            author_generation(previous_author),
+            profile_generation(username(previous_author)),
+        ]
+    after_commit(bump_generation, *names)
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_slug(sender, instance, **kwargs):
+    instance._previous_slug = None
+    if instance.pk is not None:
+        instance._previous_slug = Group.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_pages_changed(sender, instance, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_previous_slug', None)}
+    after_commit(
+        bump_generation,
+        POSTS, GROUPS, group_info_generation(instance.pk),
+        *(group_generation(slug) for slug in slugs - {None})
+    )
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_post(sender, instance, **kwargs):
+    """Запоминает прежнюю запись редактируемого комментария."""
+    instance._previous_post_id = None
+    if instance.pk is not None:
+        instance._previous_post_id = Comment.objects.filter(
+            pk=instance.pk
+        ).values_list('post_id', flat=True).first()
+
+
+def comment_count_changes(instance, kwargs):
+    """Записи, счетчики комментариев которых меняет сигнал: {id: delta}."""
+    if 'created' not in kwargs:
+        return {instance.post_id: -1}
+    if kwargs['created']:
+        return {instance.post_id: 1}
+    previous = getattr(instance, '_previous_post_id', None)
+    if previous == instance.post_id:
+        return {}
+    return {previous: -1, instance.post_id: 1}
+
+
+def deleted_posts():
+    """Записи, удаляемые в текущем потоке: {id: (база, сброс отметки)}."""
+    if not hasattr(_local, 'deleted_posts'):
+        _local.deleted_posts = {}
+    return _local.deleted_posts
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleted_post(sender, instance, using, **kwargs):
+    """Запоминает удаляемую запись до коммита: комментарии удаляются
+    каскадом вместе с ней, и их счетчик и страницы не нужны."""
+    pk = instance.pk
+
+    def forget():
+        deleted_posts().pop(pk, None)
+
+    deleted_posts()[pk] = (using, forget)
+    transaction.on_commit(forget, using=using)
+
+
+def is_post_deleted(post_id):
+    """Запись удаляется в текущей транзакции.
+
+    Отметка действует, пока ее сброс ждет коммита. При откате,
+    в том числе до точки сохранения, Django отменяет ждущие функции,
+    и отметка больше не действует.
+    """
+    marker = deleted_posts().get(post_id)
+    if marker is None:
+        return False
+    using, forget = marker
+    if any(
+        func is forget
+        for _, func in transaction.get_connection(using).run_on_commit
+    ):
+        return True
+    forget()
+    return False
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_pages_changed(sender, instance, **kwargs):
+    """Обновляет счетчики комментариев и сбрасывает страницы записи,
+    ее автора и групп. Главная показывает счетчик с задержкой до
+    CACHE_TIME: иначе каждый комментарий сбрасывал бы ее целиком."""
+    if 'created' not in kwargs and is_post_deleted(instance.post_id):
+        return
+    changes = comment_count_changes(instance, kwargs)
+    for post_id, delta in changes.items():
+        change_comment_count(post_id, delta)
+    # Автор и группа записей - из кэша объектов, до его сброса.
+    posts = get_posts(list(set(changes) - {None}))
+    after_commit(forget_entities, Post, [post.pk for post in posts])
+    after_commit(
+        bump_generation,
+        post_generation(instance.post_id),
+        *(name for post in posts for name in object_feed_generations(post))
+    )
+
+
+@receiver(pre_save, sender=User)
+def remember_user_names(sender, instance, update_fields=None, **kwargs):
+    """Запоминает имя пользователя, если оно может измениться."""
+    instance._previous_names = None
+    if update_fields is not None and not set(update_fields) & set(
+        USER_NAME_FIELDS
+    ):
+        return
+    if instance.pk is not None:
+        instance._previous_names = User.objects.filter(
+            pk=instance.pk
+        ).values_list(*USER_NAME_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_pages_changed(sender, instance, created, **kwargs):
+    """Сбрасывает страницы с именем пользователя, если оно изменилось."""
+    previous = getattr(instance, '_previous_names', None)
+    names = tuple(getattr(instance, field) for field in USER_NAME_FIELDS)
+    if created:
+        after_commit(bump_generation, profile_generation(instance.username))
+    elif previous is not None and previous != names:
+        after_commit(
+            bump_generation,
+            POSTS,
+            author_generation(instance.pk),
+            user_generation(instance.pk),
+            profile_generation(previous[0]),
+            profile_generation(instance.username),
+            *[
+                group_generation(slug) for slug in Group.objects.filter(
+                    posts__author=instance
+                ).values_list('slug', flat=True).distinct()
+            ]
+        )
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    after_commit(bump_generation, profile_generation(instance.username))
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        followers = follower_ids(instance.author_id)
+        follow_feeds = [follow_feed(user_id) for user_id in followers]
+        after_commit(incr_count, post_feeds(instance))
+        after_commit(forget_count, follow_feeds)
+        after_commit(forget_feed_ids, post_feeds(instance) + follow_feeds)
+        after_commit(forget_unread, followers)
+        after_commit(push_to_timeline, instance)
+        if is_materialized():
+            push_to_followers(instance)
+        reindex_author(instance.author_id, instance)
+        reindex_group(instance.group_id, instance)
+        return
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        group_feeds = [
+            group_feed(group_id)
+            for group_id in (previous_group_id, instance.group_id)
+            if group_id is not None
+        ]
+        after_commit(forget_count, group_feeds)
+        after_commit(forget_feed_ids, group_feeds)
+        reindex_group(previous_group_id, instance)
+        reindex_group(instance.group_id, instance)
+    previous_author = previous_author_id(instance)
+    if previous_author is not None:
+        author_changed(instance, previous_author)
+
+
+def author_changed(post, previous_author):
+    """Переносит запись из лент прежнего автора в ленты нового."""
+    author_ids = (previous_author, post.author_id)
+    followers = list({
+        user_id for author_id in author_ids
+        for user_id in follower_ids(author_id)
+    })
+    feeds = [author_feed(author_id) for author_id in author_ids] + [
+        follow_feed(user_id) for user_id in followers
+    ]
+    after_commit(forget_count, feeds)
+    after_commit(forget_feed_ids, feeds)
+    after_commit(forget_unread, followers)
+    after_commit(forget_post_author, post.pk)
+    for author_id in author_ids:
+        after_commit(forget_timeline, author_id)
+        reindex_author(author_id, post)
+    if is_materialized():
+        FeedEntry.objects.filter(post=post).delete()
+        push_to_followers(post)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    followers = follower_ids(instance.author_id)
+    follow_feeds = [follow_feed(user_id) for user_id in followers]
+    after_commit(incr_count, post_feeds(instance), -1)
+    after_commit(forget_count, follow_feeds)
+    after_commit(forget_feed_ids, post_feeds(instance) + follow_feeds)
+    after_commit(forget_unread, followers)
+    after_commit(forget_timeline, instance.author_id)
+    reindex_author(instance.author_id, instance)
+    reindex_group(instance.group_id, instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_count_changed(sender, instance, **kwargs):
+    """Обновляет счетчики записей авторов в транзакции записи."""
+    if 'created' not in kwargs:
+        change_post_count(instance.author_id, -1)
+    elif kwargs['created']:
+        change_post_count(instance.author_id, 1)
+    else:
+        previous = previous_author_id(instance)
+        if previous is not None:
+            change_post_count(previous, -1)
+            change_post_count(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    PageBoundary.objects.filter(feed=group_feed(instance.pk)).delete()
+
+
+def follow_changed(follow):
+    """Сбрасывает ленту подписок подписчика и профиль автора."""
+    after_commit(forget_count, [follow_feed(follow.user_id)])
+    after_commit(forget_feed_ids, [follow_feed(follow.user_id)])
+    after_commit(forget_unread, [follow.user_id])
+    after_commit(
+        bump_generation, profile_generation(username(follow.author_id))
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created and is_materialized():
+        backfill_follow_feed(instance.user_id, instance.author_id)
+    follow_changed(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    if is_materialized():
+        drop_from_follow_feed(instance.user_id, instance.author_id)
+    follow_changed(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def entity_changed(sender, instance, **kwargs):
+    """Сбрасывает объект в кэше объектов, в том числе по прежним
+    адресу группы и имени пользователя, и запомненные промахи
+    по новым значениям."""
+    created = kwargs.get('created', False)
+    after_commit(forget_entities, sender, [instance.pk])
+    after_commit(forget_lookups, sender, 'pk', [instance.pk])
+    if created:
+        remember_created(sender, 'pk', instance.pk)
+    if sender is Group:
+        previous = getattr(instance, '_previous_slug', None)
+        after_commit(forget_lookups, Group, 'slug', [instance.slug, previous])
+        if 'created' in kwargs and previous != instance.slug:
+            remember_created(Group, 'slug', instance.slug)
+    elif sender is User:
+        previous = (getattr(instance, '_previous_names', None) or (None,))[0]
+        after_commit(
+            forget_lookups, User, 'username', [instance.username, previous]
+        )
+        if created or previous not in (None, instance.username):
+            remember_created(User, 'username', instance.username)
@@ -152,20 +152,20 @@ class PostsFormsTest(TestCase):
             (post_edited.author, self.user_author)
         )
 
+        old_group_response = self.authorized_author.get(reverse(
+            'posts:group_list',
+            kwargs={'slug': self.group.slug})
+        )
+        new_group_response = self.authorized_author.get(reverse(
+            'posts:group_list',
+            kwargs={'slug': new_group.slug})
+        )
         for param, expected in values:
             with self.subTest(param=param):
                 self.assertEqual(param, expected)
                 self.assertEqual(Post.objects.count(), 1)
-                old_group_response = self.authorized_author.get(reverse(
-                    'posts:group_list',
-                    kwargs={'slug': self.group.slug})
-                )
                 self.assertEqual(
                     old_group_response.context['page_obj'].paginator.count, 0)
-                new_group_response = self.authorized_author.get(reverse(
-                    'posts:group_list',
-                    kwargs={'slug': new_group.slug})
-                )
                 self.assertEqual(
                     new_group_response.context['page_obj'].paginator.count, 1)
 
@@ -0,0 +1,111 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)\b(?! USING)')
+# Запросы, которым нужна вся таблица: список групп в форме записи.
+FULL_TABLE_QUERIES = (
+    'SELECT "posts_group"."id", "posts_group"."title", '
+    '"posts_group"."slug", "posts_group"."description" FROM "posts_group"',
+)
+
+
+def query_plan(sql):
+    """Строки EXPLAIN QUERY PLAN запроса."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def bad_steps(plan):
+    """Полные просмотры таблиц без индекса и сортировки во временном
+    B-дереве. Просмотр подзапроса с LIMIT полным не считается."""
+    tables = connection.introspection.table_names()
+    return [
+        step for step in plan
+        if 'TEMP B-TREE' in step
+        or SCAN_RE.match(step) and SCAN_RE.match(step).group(1) in tables
+    ]
+
+
+@override_settings(FEED_IDS_SIZE=1)
+class QueryPlanTest(TestCase):
+    """Запросы страниц идут по индексам, без полных просмотров
+    и сортировок во временном B-дереве.
+
+    Планы проверяются в SQLite, на которой работает проект.
+    FEED_IDS_SIZE=1, чтобы страницы лент читались из базы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group
+        )
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def assertIndexedQueries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, data)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if (
+                not sql.lstrip().upper().startswith('SELECT')
+                or sql in FULL_TABLE_QUERIES
+            ):
+                continue
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(bad_steps(query_plan(sql)), [])
+
+    def test_pages(self):
+        """Страницы сайта читают данные по индексам."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:index') + '?page=2',
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:group_list', args=[self.group.slug]) + '?page=2',
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:profile', args=[self.author.username])
+            + '?page=2',
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:follow_index'),
+            reverse('posts:post_create'),
+        )
+        for url in urls:
+            self.assertIndexedQueries('get', url)
+
+    def test_actions(self):
+        """Комментарий и подписки проверяются и пишутся по индексам."""
+        self.assertIndexedQueries(
+            'post', reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Новый комментарий'}
+        )
+        self.assertIndexedQueries(
+            'get', reverse('posts:profile_unfollow', args=['author'])
+        )
+        self.assertIndexedQueries(
+            'get', reverse('posts:profile_follow', args=['author'])
+        )
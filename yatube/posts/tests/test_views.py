@@ -1,24 +1,69 @@
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.http import Http404
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from core.caching import generation_key, get_generations
+
+from ..entities import (entity_key, forget_entities, get_entity_or_404,
+                        get_post_or_404, lookup_filter_key)
+from ..feeds import INDEX_FEED, get_timelines, group_feed
+from ..generations import (POSTS, author_generation,
+                           profile_page_generations)
 from ..forms import PostForm, forms
-from ..models import Comment, Follow, Group, Post
+from ..models import (AuthorStats, Comment, FeedEntry, Follow, Group,
+                      PageBoundary, Post)
+from ..paginators import (BoundaryPaginator, CountingPaginator, count_key,
+                          extend_boundaries)
+from ..warmup import warmup_urls
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 User = get_user_model()
 
 
+class OnCommitTestCase(TestCase):
+    """TestCase, в котором колбэки on_commit выполняются сразу.
+
+    Транзакция теста не коммитится, а кэш сбрасывается после коммита
+    (см. posts.signals.after_commit).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.on_commit_patcher = mock.patch.object(
+            transaction, 'on_commit', lambda func, using=None: func()
+        )
+        cls.on_commit_patcher.start()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.on_commit_patcher.stop()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.on_commit_patcher.stop()
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
-class PostsViewsTest(TestCase):
+class PostsViewsTest(OnCommitTestCase):
     @classmethod
     def setUpClass(cls):
         """Создаем тестовый пост и группу."""
@@ -218,9 +263,7 @@ class PostsViewsTest(TestCase):
         )
         response = self.auth_client.get(reverse('posts:index'))
         posts = response.content.decode('utf-8')
-        cache_posts = response.content.decode('utf-8')
-        self.assertEqual(posts, cache_posts)
-        new_post.delete()
+        Post.objects.filter(pk=new_post.pk).update(text='Без сигналов')
         response = self.auth_client.get(reverse('posts:index'))
         cache_posts = response.content.decode('utf-8')
         self.assertEqual(posts, cache_posts)
@@ -229,6 +272,113 @@ class PostsViewsTest(TestCase):
         cache_posts = response_clear.content.decode('utf-8')
         self.assertNotEqual(posts, cache_posts)
 
+    def test_cache_generation(self):
+        """Изменение записей сразу сбрасывает кэш главной страницы."""
+        new_post = Post.objects.create(
+            text='Тест кэша',
+            author=self.author
+        )
+        response = self.auth_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Тест кэша')
+        new_post.delete()
+        response = self.auth_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Тест кэша')
+        self.group.title = 'Новое название группы'
+        self.group.save()
+        response = self.auth_client.get(reverse('posts:index'))
+        self.assertContains(response, self.post.text)
+
+    def test_cache_read_your_writes(self):
+        """Автор видит свою запись, даже если кэш другого процесса
+        отстал, остальные получают страницу из кэша."""
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        self.auth_client.get(url)
+        Client().get(url)
+        keys = [generation_key(name) for name in
+                profile_page_generations(self.author.username)]
+        stale = cache.get_many(keys)
+        self.auth_client.post(
+            reverse('posts:post_create'), data={'text': 'Своя запись'}
+        )
+        cache.set_many(stale, None)
+        self.assertContains(self.auth_client.get(url), 'Своя запись')
+        self.assertNotContains(Client().get(url), 'Своя запись')
+
+    def test_object_pages_cache(self):
+        """Страницы группы, профиля и записи сбрасываются точно."""
+        urls = (
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        self.auth_client.get(urls[2])
+        for url in urls:
+            with self.subTest(url=url):
+                self.auth_client.get(url)
+                self.assertIsNone(self.auth_client.get(url).context)
+        Comment.objects.create(
+            post=self.post, author=self.follower, text='Новый комментарий'
+        )
+        self.assertContains(self.auth_client.get(urls[2]), 'Новый комментарий')
+        # Счетчик комментариев выводится и в лентах.
+        self.assertContains(
+            self.auth_client.get(urls[0]),
+            f'Комментариев: {self.post.comments.count()}'
+        )
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленная запись'
+        post.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.auth_client.get(url), 'Исправленная запись'
+                )
+
+    def test_comment_keeps_index_generation(self):
+        """Комментарий не сбрасывает главную страницу."""
+        generation = get_generations([POSTS])
+        Comment.objects.create(
+            post=self.post, author=self.follower, text='Комментарий'
+        )
+        self.assertEqual(get_generations([POSTS]), generation)
+
+    def test_profile_cache_follow_state(self):
+        """Кнопка подписки в кэше профиля своя у каждого пользователя."""
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        self.assertContains(self.auth_follower.get(url), 'Подписаться')
+        self.auth_follower.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.author.username})
+        )
+        self.assertContains(self.auth_follower.get(url), 'Отписаться')
+        other = User.objects.create(username='other')
+        other_client = Client()
+        other_client.force_login(other)
+        self.assertContains(other_client.get(url), 'Подписаться')
+
+    def test_post_card_fragment_cache(self):
+        """Карточка записи в ленте сбрасывается при правке записи,
+        переименовании группы и смене имени автора."""
+        url = reverse('posts:follow_index')
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.auth_follower.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        self.assertContains(self.auth_follower.get(url), self.post.text)
+        changes = (
+            (Post, self.post.pk, 'text', 'Исправленная запись'),
+            (Group, self.group.pk, 'slug', 'new-slug'),
+            (User, self.author.pk, 'first_name', 'Новое имя'),
+        )
+        for model, pk, field, value in changes:
+            with self.subTest(model=model):
+                instance = model.objects.get(pk=pk)
+                setattr(instance, field, value)
+                instance.save()
+                self.assertContains(self.auth_follower.get(url), value)
+
     def test_follow(self):
         """Авторизованный пользователь может подписываться на других
         пользователей и удалять их из подписок. """
@@ -257,6 +407,147 @@ class PostsViewsTest(TestCase):
             ) + f'?next=/profile/{self.follower.username}/follow/'
         )
 
+    def test_follow_feed_is_materialized(self):
+        """Лента подписок заполняется при подписке и новых записях
+        и очищается при отписке."""
+        self.auth_follower.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.author.username})
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.follower, post=self.post)
+        )
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        response = self.auth_follower.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']],
+            [new_post.pk, self.post.pk]
+        )
+        self.auth_follower.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.author.username})
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.follower))
+        FeedEntry.objects.create(
+            user=self.follower, post=self.post, author=self.author,
+            pub_date=self.post.pub_date
+        )
+        call_command('rebuild_follow_feed', stdout=StringIO())
+        self.assertFalse(FeedEntry.objects.filter(user=self.follower))
+
+    def test_author_change(self):
+        """Запись, переданная другому автору, переезжает в его профиль
+        и ленты его подписчиков."""
+        other_author = User.objects.create(username='other_author')
+        other_follower = User.objects.create(username='other_follower')
+        other_client = Client()
+        other_client.force_login(other_follower)
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=other_follower, author=other_author)
+        profiles = [
+            reverse('posts:profile', args=[user.username])
+            for user in (self.author, other_author)
+        ]
+        for url in profiles:
+            self.client.get(url)
+        self.auth_follower.get(reverse('posts:follow_index'))
+        other_client.get(reverse('posts:follow_index'))
+        self.client.get(reverse('posts:post_detail', args=[self.post.pk]))
+        post = Post.objects.get(pk=self.post.pk)
+        post.author = other_author
+        post.save()
+        self.assertNotContains(self.client.get(profiles[0]), post.text)
+        self.assertContains(self.client.get(profiles[1]), post.text)
+        self.assertEqual(
+            list(FeedEntry.objects.filter(post=post).values_list(
+                'user_id', 'author_id'
+            )),
+            [(other_follower.pk, other_author.pk)]
+        )
+        self.assertNotContains(
+            self.auth_follower.get(reverse('posts:follow_index')), post.text
+        )
+        self.assertContains(
+            other_client.get(reverse('posts:follow_index')), post.text
+        )
+        self.assertEqual(
+            self.client.get(
+                reverse('posts:post_detail', args=[post.pk])
+            ).context['post'].author,
+            other_author
+        )
+
+    @override_settings(FOLLOW_FEED_ENGINE='merge')
+    def test_follow_feed_merge(self):
+        """Лента подписок собирается слиянием лент авторов."""
+        other_author = User.objects.create(username='other_author')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=other_author)
+        self.assertFalse(FeedEntry.objects.filter(user=self.follower))
+        response = self.auth_follower.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 1)
+        posts = [
+            Post.objects.create(text=f'Пост {i}', author=author)
+            for i, author in enumerate(
+                (other_author, self.author, other_author)
+            )
+        ]
+        response = self.auth_follower.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']],
+            [post.pk for post in reversed(posts)] + [self.post.pk]
+        )
+
+    def test_follow_unread_count(self):
+        """Счетчик новых записей растет при публикации и сбрасывается
+        после просмотра ленты подписок."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.auth_follower.get(reverse('posts:follow_index'))
+        response = self.auth_follower.get(reverse('posts:index'))
+        self.assertEqual(response.context['unread_posts'], 0)
+        Post.objects.create(text='Новый пост', author=self.author)
+        Post.objects.create(text='Еще пост', author=self.author)
+        response = self.auth_follower.get(reverse('about:author'))
+        self.assertEqual(response.context['unread_posts'], 2)
+        cache.clear()
+        response = self.auth_follower.get(reverse('about:author'))
+        self.assertEqual(response.context['unread_posts'], 2)
+        self.auth_follower.get(reverse('posts:follow_index'))
+        response = self.auth_follower.get(reverse('about:author'))
+        self.assertEqual(response.context['unread_posts'], 0)
+
+    def test_new_post_cache_calls_per_follower(self):
+        """Счетчики и страницы подписчиков сбрасываются пакетом:
+        число incr не зависит от числа подписчиков."""
+        def incr_calls(text):
+            with mock.patch.object(cache, 'incr', wraps=cache.incr) as incr:
+                Post.objects.create(text=text, author=self.author)
+            return incr.call_count
+
+        Follow.objects.create(user=self.follower, author=self.author)
+        calls = incr_calls('Для одного подписчика')
+        for i in range(5):
+            Follow.objects.create(
+                user=User.objects.create(username=f'follower_{i}'),
+                author=self.author
+            )
+        self.assertEqual(incr_calls('Для шести подписчиков'), calls)
+
+    def test_unread_badge_in_cached_pages(self):
+        """Число новых записей в шапке закэшированной страницы
+        меняется вместе со счетчиком."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        url = reverse('posts:group_list', args=[self.group.slug])
+        self.auth_follower.get(reverse('posts:follow_index'))
+        self.assertNotContains(self.auth_follower.get(url), 'bg-danger')
+        Post.objects.create(text='Новый пост', author=self.author)
+        self.assertContains(
+            self.auth_follower.get(url),
+            '<span class="badge bg-danger">1</span>'
+        )
+        self.auth_follower.get(reverse('posts:follow_index'))
+        self.assertNotContains(self.auth_follower.get(url), 'bg-danger')
+
     def test_follow_index(self):
         """Новая запись пользователя появляется в ленте тех, кто на него
         подписан и не появляется в ленте тех, кто не подписан. """
@@ -276,7 +567,7 @@ class PostsViewsTest(TestCase):
                     posts_exists)
 
 
-class PaginatorTest(TestCase):
+class PaginatorTest(OnCommitTestCase):
     @classmethod
     def setUpClass(cls):
         """Создаем записи и группу."""
@@ -323,3 +614,792 @@ class PaginatorTest(TestCase):
                 self.assertEqual(len(response_posts2.context['page_obj']),
                                  3)
                 self.assertEqual(response_posts1.status_code, HTTPStatus.OK)
+
+    def test_cursor_paginator(self):
+        """Курсорная пагинация проходит ленту без пропусков и повторов."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.auth_client.get(url + '?cursor=')
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                page_obj = response.context['page_obj']
+                self.assertTrue(page_obj.is_cursor)
+        cache.clear()
+        first_page = self.auth_client.get(
+            reverse('posts:index') + '?cursor=').context['page_obj']
+        self.assertEqual(len(first_page), settings.VISIBLE_POSTS)
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+        Post.objects.create(text='Новый пост', author=self.author)
+        cache.clear()
+        second_page = self.auth_client.get(
+            reverse('posts:index') + f'?cursor={first_page.next_cursor}'
+        ).context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(second_page.has_next())
+        ids = [post.pk for post in first_page] + [
+            post.pk for post in second_page]
+        self.assertEqual(len(set(ids)), settings.VISIBLE_POSTS + 3)
+        previous_page = self.auth_client.get(
+            reverse('posts:index')
+            + f'?cursor={second_page.previous_cursor}'
+        ).context['page_obj']
+        self.assertEqual(
+            [post.pk for post in previous_page],
+            [post.pk for post in first_page]
+        )
+
+    def test_cursor_paginator_bad_cursor(self):
+        """Битый курсор открывает первую страницу."""
+        response = self.auth_client.get(
+            reverse('posts:index') + '?cursor=broken')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+@override_settings(PAGINATOR_COUNT_CACHE_FROM=1, FEED_IDS_SIZE=1)
+class CountingPaginatorTest(OnCommitTestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Создаем записи и группу."""
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(5):
+            Post.objects.create(
+                text=f'Тестовый пост {i}', author=cls.author, group=cls.group
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_paginator(self):
+        return CountingPaginator(
+            self.group.posts.all(), settings.VISIBLE_POSTS,
+            group_feed(self.group.pk)
+        )
+
+    def test_count_is_cached(self):
+        """Количество записей ленты считается один раз."""
+        self.assertEqual(self.get_paginator().count, 5)
+        self.assertEqual(cache.get(count_key(group_feed(self.group.pk))), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_paginator().count, 5)
+
+    def test_count_follows_posts(self):
+        """Счетчик обновляется при создании, переносе и удалении записи."""
+        self.get_paginator().count
+        post = Post.objects.create(
+            text='Новый пост', author=self.author, group=self.group
+        )
+        self.assertEqual(self.get_paginator().count, 6)
+        post.delete()
+        self.assertEqual(self.get_paginator().count, 5)
+        post = self.group.posts.first()
+        post.group = None
+        post.save()
+        self.assertEqual(self.get_paginator().count, 4)
+
+    @override_settings(PAGINATOR_COUNT_ESTIMATE_FROM=10, FEED_IDS_SIZE=10)
+    def test_count_estimate(self):
+        """Большие ленты не считаются целиком, а оцениваются по id
+        с пропусками с точностью до 10%."""
+        group = Group.objects.create(
+            title='Большая группа', slug='big', description='Описание'
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.author, group=group)
+            for i in range(90)
+        )
+        posts = group.posts.all()
+        Post.objects.filter(
+            pk__in=[pk for pk in posts.values_list('pk', flat=True)
+                    if pk % 3 == 0]
+        ).delete()
+        paginator = CountingPaginator(
+            posts, settings.VISIBLE_POSTS, group_feed(group.pk)
+        )
+        count = posts.count()
+        with mock.patch.object(
+            CountingPaginator, 'estimate_count', autospec=True,
+            side_effect=CountingPaginator.estimate_count
+        ) as estimate_count:
+            self.assertAlmostEqual(paginator.count, count, delta=count * 0.1)
+        estimate_count.assert_called_once()
+
+    def test_elided_page_range(self):
+        """Список страниц не растет вместе с лентой."""
+        paginator = CountingPaginator(range(200000), 10)
+        page = paginator.get_page(500)
+        ellipsis = paginator.ELLIPSIS
+        self.assertEqual(
+            page.elided_page_range,
+            [1, 2, ellipsis, 497, 498, 499, 500, 501, 502, 503, ellipsis,
+             19999, 20000]
+        )
+        self.assertEqual(
+            paginator.get_page(1).elided_page_range,
+            [1, 2, 3, 4, ellipsis, 19999, 20000]
+        )
+        self.assertEqual(
+            CountingPaginator(range(30), 10).get_page(1).elided_page_range,
+            [1, 2, 3]
+        )
+
+
+class FeedCacheTest(OnCommitTestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Создаем записи и группу."""
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(settings.VISIBLE_POSTS + 5):
+            Post.objects.create(
+                text=f'Тестовый пост {i}', author=cls.author, group=cls.group
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, number=1):
+        return CountingPaginator(
+            Post.objects.select_related('author', 'group'),
+            settings.VISIBLE_POSTS, INDEX_FEED
+        ).page(number)
+
+    def test_page_from_cache(self):
+        """Страница ленты собирается из кэша id и объектов без запросов."""
+        offset = Paginator(Post.objects.all(), settings.VISIBLE_POSTS)
+        for number in offset.page_range:
+            with self.subTest(number=number):
+                self.assertEqual(
+                    [post.pk for post in self.get_page(number)],
+                    [post.pk for post in offset.page(number)]
+                )
+        with self.assertNumQueries(0):
+            post = self.get_page()[0]
+            self.assertEqual(post.author.username, 'user')
+            self.assertEqual(post.group.slug, 'test-slug')
+
+    def test_edit_forgets_one_entity(self):
+        """Правка записи и имени автора видна в ленте без сброса
+        списка id."""
+        self.get_page()
+        post = Post.objects.latest('pub_date')
+        post.text = 'Новый текст'
+        post.save()
+        self.author.first_name = 'Лев'
+        self.author.save()
+        with self.assertNumQueries(2):
+            first = self.get_page()[0]
+        self.assertEqual(first.text, 'Новый текст')
+        self.assertEqual(first.author.first_name, 'Лев')
+
+    def test_new_post_in_feed(self):
+        """Новая запись сразу попадает в ленту."""
+        self.get_page()
+        post = Post.objects.create(text='Новый пост', author=self.author)
+        page = self.get_page()
+        self.assertEqual(page[0], post)
+        self.assertEqual(page.paginator.count, settings.VISIBLE_POSTS + 6)
+
+    @override_settings(FOLLOW_TIMELINE_SIZE=3)
+    def test_timelines_in_one_query(self):
+        """Ленты авторов, которых нет в кэше, читаются одним запросом."""
+        other = User.objects.create_user(username='other')
+        post = Post.objects.create(text='Пост другого автора', author=other)
+        with self.assertNumQueries(1):
+            timelines = get_timelines([self.author.pk, other.pk])
+        self.assertEqual(
+            [[pk for pub_date, pk in timeline] for timeline in timelines],
+            [
+                list(self.author.posts.values_list('pk', flat=True)[:3]),
+                [post.pk],
+            ]
+        )
+        with self.assertNumQueries(0):
+            get_timelines([self.author.pk, other.pk])
+
+
+# Фильтры обновляются после коммита, которого в TestCase нет
+# (см. NegativeLookupTest).
+@override_settings(LOOKUP_FILTER_ENABLED=False)
+class EntityCacheTest(OnCommitTestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Создаем пользователя, группу и запись."""
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def test_lookups_are_cached(self):
+        """Повторный поиск по адресу, имени и id не обращается к базе."""
+        lookups = (
+            (Group, {'slug': 'test-slug'}),
+            (User, {'username': 'user'}),
+            (Post, {'id': str(self.post.pk)}),
+        )
+        for model, lookup in lookups:
+            with self.subTest(model=model):
+                get_entity_or_404(model, **lookup)
+                with self.assertNumQueries(0):
+                    entity = get_entity_or_404(model, **lookup)
+                self.assertEqual(entity, model.objects.get(**lookup))
+        with self.assertNumQueries(0):
+            post = get_post_or_404(self.post.pk)
+            self.assertEqual(post.author.username, 'user')
+            self.assertEqual(post.group.slug, 'test-slug')
+
+    def test_renamed_lookups_are_forgotten(self):
+        """После смены адреса группы и имени пользователя прежние
+        адреса не открываются."""
+        get_entity_or_404(Group, slug='test-slug')
+        get_entity_or_404(User, username='user')
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'new-slug'
+        group.save()
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'new-user'
+        author.save()
+        for model, lookup in (
+            (Group, {'slug': 'test-slug'}), (User, {'username': 'user'})
+        ):
+            with self.subTest(model=model):
+                with self.assertRaises(Http404):
+                    get_entity_or_404(model, **lookup)
+        self.assertEqual(get_entity_or_404(Group, slug='new-slug'), group)
+        self.assertEqual(get_entity_or_404(User, username='new-user'), author)
+
+    def test_missing_post(self):
+        """Несуществующая и нечисловая запись отдают 404."""
+        for url in (
+            reverse('posts:add_comment', args=(self.post.pk + 1,)),
+            reverse('posts:post_edit', args=('abc',)),
+        ):
+            with self.subTest(url=url):
+                response = self.client.post(url, {'text': 'Комментарий'})
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_missing_post_page(self):
+        """Повторный запрос несуществующей записи не идет в базу."""
+        client = Client()
+        url = reverse('posts:post_detail', args=(self.post.pk + 1000,))
+        self.assertEqual(client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(url).status_code, 404)
+        self.assertIsNone(
+            cache.get(generation_key(author_generation(None)))
+        )
+
+    def test_add_comment_does_not_load_post(self):
+        """Комментарий добавляется без чтения строки записи."""
+        get_post_or_404(self.post.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                reverse('posts:add_comment', args=(self.post.pk,)),
+                {'text': 'Комментарий'}
+            )
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "posts_post"' in query['sql']
+        ])
+        self.assertTrue(
+            Comment.objects.filter(post=self.post, text='Комментарий').exists()
+        )
+
+
+class CommitInvalidationTest(TransactionTestCase):
+    """Кэш сбрасывается после коммита записи."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='user')
+        self.post = Post.objects.create(
+            text='Старый текст', author=self.author
+        )
+
+    def test_reader_before_commit(self):
+        """Данные, закэшированные до коммита параллельным запросом,
+        не переживают коммит."""
+        feed_key = f'posts:ids:{INDEX_FEED}'
+        with transaction.atomic():
+            self.post.text = 'Новый текст'
+            self.post.save()
+            Post.objects.create(text='Еще запись', author=self.author)
+            # Параллельный запрос еще видит прежние данные.
+            stale = Post.objects.get(pk=self.post.pk)
+            stale.text = 'Старый текст'
+            cache.set(entity_key(Post, self.post.pk), stale)
+            cache.set(feed_key, [self.post.pk])
+        self.assertIsNone(cache.get(entity_key(Post, self.post.pk)))
+        self.assertIsNone(cache.get(feed_key))
+        self.assertEqual(get_post_or_404(self.post.pk).text, 'Новый текст')
+
+    def test_comment_before_commit(self):
+        """Запись со старым счетчиком комментариев, закэшированная
+        до коммита, не переживает коммит."""
+        with transaction.atomic():
+            Comment.objects.create(
+                post=self.post, author=self.author, text='Комментарий'
+            )
+            stale = Post.objects.get(pk=self.post.pk)
+            stale.comment_count = 0
+            cache.set(entity_key(Post, self.post.pk), stale)
+        self.assertEqual(get_post_or_404(self.post.pk).comment_count, 1)
+
+
+@override_settings(LOOKUP_FILTER_ENABLED=True)
+class NegativeLookupTest(TransactionTestCase):
+    """Фильтры обновляются после коммита, поэтому тесты без общей
+    транзакции."""
+
+    def setUp(self):
+        """Создаем пользователя, группу и записи."""
+        cache.clear()
+        self.author = User.objects.create_user(username='user')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        self.posts = [
+            Post.objects.create(text=f'Тестовый пост {i}', author=self.author)
+            for i in range(2)
+        ]
+        call_command('build_lookup_filters', stdout=StringIO())
+
+    def test_missing_without_queries(self):
+        """Несуществующие имя, адрес и id отсекаются без базы."""
+        lookups = (
+            (User, {'username': 'nobody'}),
+            (Group, {'slug': 'no-such-group'}),
+            (Post, {'pk': self.posts[-1].pk + 1000}),
+        )
+        for model, lookup in lookups:
+            with self.subTest(model=model):
+                with self.assertNumQueries(0):
+                    with self.assertRaises(Http404):
+                        get_entity_or_404(model, **lookup)
+
+    def test_missing_is_remembered(self):
+        """Промах по удаленной записи запоминается."""
+        post_id = self.posts[0].pk
+        Post.objects.filter(pk=post_id).delete()
+        with self.assertRaises(Http404):
+            get_entity_or_404(Post, pk=post_id)
+        with self.assertNumQueries(0):
+            with self.assertRaises(Http404):
+                get_entity_or_404(Post, pk=post_id)
+
+    def test_created_after_filter(self):
+        """Созданные после сборки фильтра объекты находятся,
+        даже если отметка создания пропала из кэша."""
+        with self.assertRaises(Http404):
+            get_entity_or_404(User, username='newcomer')
+        user = User.objects.create_user(username='newcomer')
+        group = Group.objects.create(
+            title='Новая группа', slug='new-group', description='Описание'
+        )
+        post = Post.objects.create(text='Новый пост', author=self.author)
+        forget_entities(User, [user.pk])
+        forget_entities(Post, [post.pk])
+        self.assertEqual(get_entity_or_404(User, username='newcomer'), user)
+        self.assertEqual(get_entity_or_404(Group, slug='new-group'), group)
+        self.assertEqual(get_entity_or_404(Post, pk=post.pk), post)
+        group.slug = 'renamed-group'
+        group.save()
+        self.assertEqual(get_entity_or_404(Group, slug='renamed-group'), group)
+        with self.assertNumQueries(0):
+            with self.assertRaises(Http404):
+                get_entity_or_404(User, username='still-nobody')
+
+    def test_filter_kept_in_memory(self):
+        """Фильтр читается из кэша заново, только когда в него
+        добавляют значение."""
+        key = lookup_filter_key(User, 'username')
+
+        def filter_reads(username):
+            with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+                with self.assertRaises(Http404):
+                    get_entity_or_404(User, username=username)
+            return [call for call in get.call_args_list if call[0][0] == key]
+
+        filter_reads('nobody')
+        self.assertFalse(filter_reads('nobody-else'))
+        User.objects.create_user(username='newcomer')
+        self.assertTrue(filter_reads('still-nobody'))
+        self.assertFalse(filter_reads('nobody-again'))
+
+    def test_filter_busy(self):
+        """Если фильтр занят другим процессом, он сбрасывается,
+        а не остается без нового значения."""
+        key = lookup_filter_key(User, 'username')
+        cache.set(f'{key}.lock', 1)
+        User.objects.create_user(username='newcomer')
+        self.assertIsNone(cache.get(key))
+        cache.delete(f'{key}.lock')
+        self.assertTrue(get_entity_or_404(User, username='newcomer'))
+
+    @override_settings(LOOKUP_FILTER_ENABLED=False)
+    def test_disabled(self):
+        """Без LOOKUP_FILTER_ENABLED фильтр не используется."""
+        with self.assertNumQueries(1):
+            with self.assertRaises(Http404):
+                get_entity_or_404(User, username='nobody')
+
+
+@override_settings(FEED_IDS_SIZE=1)
+class BoundaryPaginatorTest(OnCommitTestCase):
+    @classmethod
+    def setUpClass(cls):
+        """Создаем записи и группу."""
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(settings.VISIBLE_POSTS * 2 + 5):
+            Post.objects.create(
+                text=f'Тестовый пост {i}', author=cls.author, group=cls.group
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def assertPagesMatchOffset(self):
+        post_list = self.group.posts.all()
+        offset = Paginator(post_list, settings.VISIBLE_POSTS)
+        boundary = BoundaryPaginator(
+            post_list, settings.VISIBLE_POSTS, group_feed(self.group.pk)
+        )
+        self.assertEqual(boundary.count, offset.count)
+        for number in offset.page_range:
+            with self.subTest(number=number):
+                self.assertEqual(
+                    [post.pk for post in boundary.page(number)],
+                    [post.pk for post in offset.page(number)]
+                )
+
+    def test_boundaries_follow_posts(self):
+        """Страницы по индексу границ совпадают со страницами по OFFSET."""
+        self.assertEqual(
+            PageBoundary.objects.filter(
+                feed=group_feed(self.group.pk)).count(),
+            3
+        )
+        self.assertPagesMatchOffset()
+        Post.objects.create(
+            text='Новый пост', author=self.author, group=self.group
+        )
+        self.assertPagesMatchOffset()
+        self.group.posts.order_by('pk')[3].delete()
+        self.assertPagesMatchOffset()
+        post = self.group.posts.order_by('pk')[5]
+        post.group = None
+        post.save()
+        self.assertPagesMatchOffset()
+
+    def test_delete_extends_boundaries(self):
+        """После удаления записи границы досчитываются заново."""
+        self.group.posts.order_by('pk').first().delete()
+        self.assertEqual(
+            PageBoundary.objects.filter(
+                feed=group_feed(self.group.pk)).count(),
+            3
+        )
+        self.assertPagesMatchOffset()
+
+    def test_concurrent_extend(self):
+        """Границы, досчитанные параллельным запросом, не мешают."""
+        feed = group_feed(self.group.pk)
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            extend_boundaries(feed, self.group.posts.all())
+        self.assertEqual(PageBoundary.objects.filter(feed=feed).count(), 3)
+        self.assertPagesMatchOffset()
+
+    def test_build_page_index(self):
+        """Команда build_page_index восстанавливает индекс."""
+        PageBoundary.objects.all().delete()
+        call_command('build_page_index', stdout=StringIO())
+        self.assertEqual(
+            PageBoundary.objects.filter(
+                feed=group_feed(self.group.pk)).count(),
+            3
+        )
+        self.assertPagesMatchOffset()
+
+
+class WarmCacheTest(OnCommitTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}')
+            for number in range(3)
+        ]
+        cls.groups = [
+            Group.objects.create(
+                title=f'Группа {number}',
+                slug=f'group-{number}',
+                description='Тестовое описание',
+            )
+            for number in range(3)
+        ]
+        for number in range(3):
+            Post.objects.create(
+                text='Тестовый пост',
+                author=cls.authors[0],
+                group=cls.groups[2] if number else cls.groups[1],
+            )
+        Follow.objects.create(user=cls.authors[0], author=cls.authors[1])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warmup_urls(self):
+        """Прогреваются главная, большие группы и популярные профили."""
+        self.assertEqual(warmup_urls(2, 2, 1), [
+            reverse('posts:index'),
+            reverse('posts:index') + '?page=2',
+            reverse('posts:group_list', args=['group-2']),
+            reverse('posts:group_list', args=['group-1']),
+            reverse('posts:profile', args=['author1']),
+        ])
+
+    def test_warm_cache(self):
+        """После warm_cache страницы отдаются без запросов к базе."""
+        out = StringIO()
+        call_command(
+            'warm_cache', pages=1, groups=1, profiles=1, workers=1,
+            host='testserver', stdout=out
+        )
+        self.assertIn('Прогрето страниц testserver: 3 из 3', out.getvalue())
+        with self.assertNumQueries(0):
+            for url in (
+                reverse('posts:index'),
+                reverse('posts:group_list', args=['group-2']),
+                reverse('posts:profile', args=['author1']),
+            ):
+                self.assertEqual(
+                    self.client.get(url).status_code, HTTPStatus.OK
+                )
+
+    def test_time_limit(self):
+        """После time_limit новые страницы не запрашиваются."""
+        out = StringIO()
+        call_command(
+            'warm_cache', pages=2, groups=0, profiles=0, time_limit=-1,
+            host='testserver', stdout=out
+        )
+        self.assertIn('пропущено', out.getvalue())
+        self.assertIn('Прогрето страниц testserver: 0 из 2', out.getvalue())
+
+
+class AuthorStatsTest(OnCommitTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        cls.post = Post.objects.create(text='Первый', author=cls.author)
+        Post.objects.create(text='Второй', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def post_count(self, user):
+        return AuthorStats.objects.get(user=user).post_count
+
+    def test_counter_follows_posts(self):
+        """Счетчик меняется при создании, удалении и смене автора."""
+        self.assertEqual(self.post_count(self.author), 2)
+        Post.objects.create(text='Третий', author=self.author)
+        self.assertEqual(self.post_count(self.author), 3)
+        self.post.author = self.other
+        self.post.save()
+        self.assertEqual(self.post_count(self.author), 2)
+        self.assertEqual(self.post_count(self.other), 1)
+        Post.objects.filter(author=self.author).delete()
+        self.assertEqual(self.post_count(self.author), 0)
+        User.objects.filter(pk=self.other.pk).delete()
+        self.assertFalse(
+            AuthorStats.objects.filter(user_id=self.other.pk).exists()
+        )
+
+    def test_pages_use_counter(self):
+        """Профиль и запись показывают счетчик без COUNT по записям."""
+        AuthorStats.objects.filter(user=self.author).update(post_count=7)
+        for url in (
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            with self.subTest(url=url):
+                self.assertEqual(response.context['post_count'], 7)
+                self.assertContains(response, 'Всего постов')
+                self.assertFalse([
+                    query['sql'] for query in queries.captured_queries
+                    if 'COUNT(' in query['sql']
+                    and 'FROM "posts_post"' in query['sql']
+                ])
+
+    def test_reconcile(self):
+        """reconcile_post_counts исправляет расхождения."""
+        AuthorStats.objects.filter(user=self.author).update(post_count=7)
+        Post.objects.create(text='Чужой', author=self.other)
+        AuthorStats.objects.filter(user=self.other).delete()
+        out = StringIO()
+        call_command('reconcile_post_counts', stdout=out)
+        self.assertIn('Исправлено счетчиков записей: 2', out.getvalue())
+        self.assertEqual(self.post_count(self.author), 2)
+        self.assertEqual(self.post_count(self.other), 1)
+
+
+class CommentCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Первый', author=cls.author)
+        cls.other_post = Post.objects.create(text='Второй', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.commenter = User.objects.create_user(username='commenter')
+        self.client.force_login(self.commenter)
+
+    def comment_count(self, post):
+        return Post.objects.get(pk=post.pk).comment_count
+
+    def test_counter_follows_comments(self):
+        """Счетчик меняется при добавлении, переносе и удалении
+        комментария, в том числе вместе с его автором."""
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Комментарий'}
+        )
+        self.assertEqual(self.comment_count(self.post), 1)
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Еще один'
+        )
+        self.assertEqual(self.comment_count(self.post), 2)
+        comment.post = self.other_post
+        comment.save()
+        self.assertEqual(self.comment_count(self.post), 1)
+        self.assertEqual(self.comment_count(self.other_post), 1)
+        comment.delete()
+        self.assertEqual(self.comment_count(self.other_post), 0)
+        self.commenter.delete()
+        self.assertEqual(self.comment_count(self.post), 0)
+
+    def test_feeds_show_counter(self):
+        """Ленты показывают счетчик без COUNT по комментариям."""
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            with self.subTest(url=url):
+                self.assertContains(response, 'Комментариев: 1')
+                self.assertFalse([
+                    query['sql'] for query in queries.captured_queries
+                    if 'FROM "posts_comment"' in query['sql']
+                ])
+
+    def test_backfill(self):
+        """backfill_comment_counts пересчитывает счетчики пачками."""
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        Post.objects.update(comment_count=5)
+        out = StringIO()
+        call_command('backfill_comment_counts', batch_size=1, stdout=out)
+        self.assertIn('Исправлено счетчиков комментариев: 2', out.getvalue())
+        self.assertEqual(self.comment_count(self.post), 1)
+        self.assertEqual(self.comment_count(self.other_post), 0)
+
+    def test_backfill_refreshes_pages(self):
+        """Исправленный счетчик сразу виден в закэшированных страницах."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        Post.objects.filter(pk=self.post.pk).update(comment_count=5)
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Комментариев: 5')
+        call_command('backfill_comment_counts', stdout=StringIO())
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(
+                    self.client.get(url), 'Комментариев: 5'
+                )
+
+    def test_deleted_post_comments(self):
+        """Каскадное удаление комментариев вместе с записью не пересчитывает
+        счетчик и страницы для каждого комментария."""
+        queries = []
+        for comments in (1, 5):
+            post = Post.objects.create(text='Удаляемая', author=self.author)
+            Comment.objects.bulk_create([
+                Comment(post=post, author=self.author, text='Комментарий')
+                for _ in range(comments)
+            ])
+            with CaptureQueriesContext(connection) as captured:
+                post.delete()
+            queries.append(len(captured.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_rolled_back_post_delete(self):
+        """После отката удаления записи ее комментарии снова меняют
+        счетчик."""
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Post.objects.get(pk=self.post.pk).delete()
+                raise ValueError('откат')
+        comment.delete()
+        self.assertEqual(self.comment_count(self.post), 0)
+
+    def test_edit_keeps_counter(self):
+        """Правка записи из кэша объектов не затирает счетчик."""
+        self.client.force_login(self.author)
+        edit_url = reverse('posts:post_edit', args=[self.post.pk])
+        self.client.get(edit_url)
+        # Комментарий добавлен, пока запись лежала в кэше.
+        Post.objects.filter(pk=self.post.pk).update(comment_count=1)
+        self.client.post(edit_url, {'text': 'Исправленный'})
+        self.assertEqual(self.comment_count(self.post), 1)
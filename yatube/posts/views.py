@@ -1,35 +1,64 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.db.models import QuerySet
+from django.shortcuts import redirect, render
 
+from core.caching import cache_page_generations, remember_write
+
+from .counters import get_post_count
+from .entities import (entity_exists, get_entity_or_404, get_post_or_404,
+                       not_found)
+from .feeds import (INDEX_FEED, author_feed, follow_feed, follow_feed_posts,
+                    group_feed, mark_follow_feed_seen)
 from .forms import CommentForm, PostForm
+from .generations import (POSTS, group_page_generations,
+                          post_page_generations, profile_page_generations)
 from .models import Follow, Group, Post
-
-
-def get_page(request, post_list):
-    """Функция Paginator"""
-    paginator = Paginator(post_list, settings.VISIBLE_POSTS)
+from .paginators import BoundaryPaginator, CountingPaginator, CursorPaginator
+
+
+def get_page(request, post_list, feed=None,
+             paginator_class=CountingPaginator, count=None):
+    """Функция Paginator.
+
+    С параметром ?cursor= лента листается по ключу (pub_date, id)
+    без OFFSET и COUNT, иначе по номеру страницы ?page=.
+    Количество записей ленты feed берется из count или из кэша,
+    BoundaryPaginator открывает страницу по индексу границ страниц.
+    """
+    if 'cursor' in request.GET and isinstance(post_list, QuerySet):
+        paginator = CursorPaginator(post_list, settings.VISIBLE_POSTS)
+        return paginator.get_page(request.GET['cursor'])
+    paginator = paginator_class(
+        post_list, settings.VISIBLE_POSTS, feed, known_count=count
+    )
     page_number = request.GET.get('page')
     return paginator.get_page(page_number)
 
 
-@cache_page(settings.CACHE_TIME, key_prefix='index_page')
+@cache_page_generations(
+    settings.CACHE_TIME, key_prefix='index_page', generations=(POSTS,)
+)
 def index(request):
     """Отображает все добаленные записи"""
     posts = Post.objects.select_related('author', 'group')
-    page_obj = get_page(request, posts)
+    page_obj = get_page(request, posts, INDEX_FEED)
     context = {'page_obj': page_obj}
     return render(request, 'posts/index.html', context)
 
 
+@cache_page_generations(
+    settings.CACHE_TIME, key_prefix='group_page',
+    generations=group_page_generations
+)
 def group_posts(request, slug):
     """Отображает записи отсортированные по группам"""
-    group = get_object_or_404(Group, slug=slug)
+    group = get_entity_or_404(Group, slug=slug)
     post_list = group.posts.all()
-    page_obj = get_page(request, post_list)
+    page_obj = get_page(
+        request, post_list, group_feed(group.pk), BoundaryPaginator
+    )
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -37,36 +66,45 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@cache_page_generations(
+    settings.CACHE_TIME, key_prefix='profile_page',
+    generations=profile_page_generations
+)
 def profile(request, username):
     """Профиль пользователя"""
-    author = get_object_or_404(
-        User.objects.prefetch_related('posts', 'posts__group'),
-        username=username
+    author = get_entity_or_404(User, username=username)
+    post_list = author.posts.select_related('group')
+    post_count = get_post_count(author.pk)
+    page_obj = get_page(
+        request, post_list, author_feed(author.pk), BoundaryPaginator,
+        post_count
     )
-    post_list = author.posts.all()
-    page_obj = get_page(request, post_list)
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user, author=author
     ).exists()
     context = {
         'author': author,
+        'post_count': post_count,
         'page_obj': page_obj,
         'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache_page_generations(
+    settings.CACHE_TIME, key_prefix='post_page',
+    generations=post_page_generations
+)
 def post_detail(request, post_id):
     """Детали поста"""
-    post = get_object_or_404(
-        Post.objects.select_related('author', 'group', ), id=post_id
-    )
+    post = get_post_or_404(post_id)
     comments = post.comments.select_related('author', )
     form = CommentForm(
         request.POST or None
     )
     context = {
         'post': post,
+        'post_count': get_post_count(post.author_id),
         'form': form,
         'comments': comments,
     }
@@ -85,6 +123,7 @@ def post_create(request):
     new_post = form.save(commit=False)
     new_post.author = request.user
     form.save()
+    remember_write(request)
     return redirect('posts:profile', username=request.user)
 
 
@@ -92,8 +131,8 @@ def post_create(request):
 def post_edit(request, post_id):
     """Редактирование записи"""
     is_edit = True
-    post = get_object_or_404(Post, id=post_id)
-    if post.author != request.user:
+    post = get_entity_or_404(Post, id=post_id)
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post.id)
     form = PostForm(
         request.POST or None,
@@ -106,27 +145,31 @@ def post_edit(request, post_id):
     if not form.is_valid():
         return render(request, 'posts/create_post.html', context)
     form.save()
+    remember_write(request)
     return redirect('posts:post_detail', post.id)
 
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    if not entity_exists(Post, post_id):
+        raise not_found(Post)
     form = CommentForm(
         request.POST or None
     )
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
-        comment.post = post
+        comment.post_id = post_id
         comment.save()
+        remember_write(request)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page(request, posts)
+    posts = follow_feed_posts(request.user)
+    page_obj = get_page(request, posts, follow_feed(request.user.pk))
+    mark_follow_feed_seen(request.user, page_obj)
     context = {
         'page_obj': page_obj,
         'following': True
@@ -137,7 +180,7 @@ def follow_index(request):
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_entity_or_404(User, username=username)
     user = request.user
     if author != user:
         Follow.objects.get_or_create(
@@ -154,7 +197,7 @@ def profile_follow(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_entity_or_404(User, username=username)
     user = request.user
     if author != user:
         Follow.objects.filter(user=user,
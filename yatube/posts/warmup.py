@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db.models import Count
+from django.urls import reverse
+
+from .models import Group, User
+
+
+def warmup_urls(pages=None, groups=None, profiles=None):
+    """Страницы, которые открывают первыми после запуска.
+
+    Первые pages страниц главной, группы с наибольшим числом записей
+    и профили с наибольшим числом подписчиков. Превью картинок
+    строятся при отрисовке этих страниц.
+    """
+    pages = settings.WARMUP_PAGES if pages is None else pages
+    groups = settings.WARMUP_GROUPS if groups is None else groups
+    profiles = settings.WARMUP_PROFILES if profiles is None else profiles
+    index = reverse('posts:index')
+    urls = [
+        index if number == 1 else f'{index}?page={number}'
+        for number in range(1, pages + 1)
+    ]
+    busiest_groups = Group.objects.annotate(
+        post_count=Count('posts')
+    ).order_by('-post_count', 'pk').values_list('slug', flat=True)
+    followed_authors = User.objects.annotate(
+        follower_count=Count('following')
+    ).order_by('-follower_count', 'pk').values_list('username', flat=True)
+    urls += [
+        reverse('posts:group_list', args=[slug])
+        for slug in busiest_groups[:groups]
+    ]
+    urls += [
+        reverse('posts:profile', args=[username])
+        for username in followed_authors[:profiles]
+    ]
+    return urls
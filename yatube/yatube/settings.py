@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.CacheStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,6 +76,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'core.context_processors.unread.unread_posts',
             ],
         },
     },
@@ -134,8 +136,58 @@ STATICFILES_DIRS = [
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
-CACHE_TIME: int = 20
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+CACHE_BACKEND: str = os.getenv('CACHE_BACKEND', LOCMEM_CACHE)
+# Общий для всех воркеров кэш: только с ним изменения, сделанные
+# одним процессом, видны остальным.
+SHARED_CACHE: bool = CACHE_BACKEND != LOCMEM_CACHE
+
+# Страницы сбрасываются сменой поколения, но в кэше отдельного
+# процесса смену, сделанную другим воркером, не видно: там страницы
+# живут недолго.
+CACHE_TIME: int = 60 * 60 * 24 if SHARED_CACHE else 20
+# Поколение живет не меньше страниц, которые под ним закэшированы.
+GENERATION_CACHE_TIME: int = 60 * 60 * 24
+FRAGMENT_CACHE_TIME: int = 60 * 60 * 24
+CACHE_LOCK_TIMEOUT: int = 10
+CACHE_LOCK_WAIT: float = 2
+CACHE_STALE_GRACE: int = 60 * 5
+CACHE_REFRESH_IN_BACKGROUND: bool = True
+PAGE_GZIP_FROM: int = 200
 VISIBLE_POSTS: int = 10
+PAGINATOR_COUNT_CACHE_TIME: int = 60 * 60
+PAGINATOR_COUNT_CACHE_FROM: int = 1000
+PAGINATOR_COUNT_ESTIMATE_FROM: int = 100000
+FOLLOW_FEED_ENGINE: str = os.getenv('FOLLOW_FEED_ENGINE', 'materialized')
+FOLLOW_FEED_BACKFILL: int = 1000
+FOLLOW_TIMELINE_SIZE: int = 1000
+FOLLOW_TIMELINE_CACHE_TIME: int = 60 * 60
+FOLLOW_UNREAD_LIMIT: int = 100
+FOLLOW_UNREAD_CACHE_TIME: int = 60 * 60 * 24
+FEED_IDS_SIZE: int = 1000
+FEED_IDS_CACHE_TIME: int = 60 * 60
+ENTITY_CACHE_TIME: int = 60 * 60 * 24
+NEGATIVE_CACHE_TIME: int = 60 * 5
+# Фильтр обновляется процессом, создавшим объект, поэтому в кэше
+# отдельного процесса другие воркеры отвечали бы 404 на новые объекты.
+LOOKUP_FILTER_ENABLED: bool = SHARED_CACHE
+LOOKUP_FILTER_TIME: int = 60 * 60
+LOOKUP_FILTER_ERROR_RATE: float = 0.01
+QUERY_CACHE_ENABLED: bool = os.getenv('QUERY_CACHE', '') == 'True'
+QUERY_CACHE_STATS: bool = DEBUG
+QUERY_CACHE_TIME: int = 60 * 60
+QUERY_CACHE_MODELS = (
+    'posts.Post', 'posts.Group', 'posts.Comment', 'posts.Follow', 'auth.User',
+)
+WARMUP_ON_STARTUP: bool = os.getenv('WARMUP_ON_STARTUP', '') == 'True'
+WARMUP_URLS: str = 'posts.warmup.warmup_urls'
+WARMUP_HOST: str = os.getenv('WARMUP_HOST', '')
+WARMUP_SECURE: bool = os.getenv('WARMUP_SECURE', '') == 'True'
+WARMUP_PAGES: int = 3
+WARMUP_GROUPS: int = 5
+WARMUP_PROFILES: int = 5
+WARMUP_WORKERS: int = 4
+WARMUP_TIME_LIMIT: float = 60
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 
@@ -144,8 +196,51 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Кэш в памяти процесса подходит для одного процесса. Если воркеров
+# несколько, CACHE_BACKEND=core.cache.sqlite.SQLiteCache дает им общий
+# кэш в файле CACHE_LOCATION.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache.sqlite3')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+            'MAX_SIZE': int(os.getenv('CACHE_MAX_SIZE', 256 * 1024 * 1024)),
+            # Используется бэкендами из core.cache, LocMemCache его
+            # не читает.
+            'SERIALIZER': 'core.cache.serializers.CompactSerializer',
+        },
     }
 }
+# С CACHE_L1_CHANNEL горячие ключи читаются из памяти процесса,
+# а инвалидации рассылаются другим процессам через этот файл.
+if os.getenv('CACHE_L1_CHANNEL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.tiered.TieredCache',
+            'LOCATION': os.getenv('CACHE_L1_CHANNEL'),
+            'OPTIONS': {
+                'L2': 'shared',
+                'L1_KEYS': (
+                    'generation:', 'posts:post-author:', 'posts:entity:'
+                ),
+                'L1_MAX_ENTRIES': 1000,
+                'L1_TIMEOUT': 60,
+            },
+        },
+        'shared': CACHES['default'],
+    }
+# С CACHE_STATS=True обращения к кэшу считаются: команда cache_stats
+# и страница /metrics/cache/ (для сотрудников и по CACHE_METRICS_TOKEN).
+CACHE_METRICS_TOKEN: str = os.getenv('CACHE_METRICS_TOKEN', '')
+if os.getenv('CACHE_STATS') == 'True':
+    CACHES = dict(CACHES, default={
+        'BACKEND': 'core.cache.instrumented.InstrumentedCache',
+        'OPTIONS': {
+            'CACHE': 'measured',
+            'FLUSH_INTERVAL': 10,
+            'SERIALIZER': 'core.cache.serializers.CompactSerializer',
+        },
+    }, measured=CACHES['default'])
@@ -3,8 +3,11 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import cache_metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/cache/', cache_metrics, name='cache_metrics'),
     path('auth/', include('users.urls', namespace='users')),
     path('about/', include('about.urls', namespace='about')),
     path('auth/', include('django.contrib.auth.urls')),